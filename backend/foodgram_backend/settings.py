@@ -81,6 +81,17 @@ DATABASES = {
     }
 }
 
+# Версии данных и закэшированные ответы должны быть общими для всех
+# воркеров gunicorn и management-команд, поэтому в docker-compose кэш
+# хранится в Redis. Без REDIS_URL у каждого процесса свой кэш в памяти.
+if os.getenv("REDIS_URL"):
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": os.getenv("REDIS_URL"),
+        }
+    }
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         "NAME": "django.contrib.auth.password_validation.UserAttributeSimilarityValidator",
@@ -1,6 +1,9 @@
 from django.contrib import admin
+from django.db.models import Sum
 
-from recipes.models import Ingredient, Recipe, RecipeIngredient, RecipeTag, Tag
+from recipes.models import (Ingredient, Recipe, RecipeIngredient, RecipeTag,
+                            ShoppingCart, ShoppingListItem, Tag)
+from recipes.search import index_recipes
 
 
 class IngredientInline(admin.TabularInline):
@@ -37,3 +40,24 @@ class RecipeAdmin(admin.ModelAdmin):
         IngredientInline,
         TagInline,
     ]
+
+    @staticmethod
+    def ingredient_amounts(recipe):
+        return dict(RecipeIngredient.objects.filter(recipe=recipe).values_list(
+            "ingredient_id").annotate(total=Sum("amount")))
+
+    def save_related(self, request, form, formsets, change):
+        """Переносит изменения состава рецепта в списки покупок."""
+        recipe = form.instance
+        old = self.ingredient_amounts(recipe) if change else {}
+        super().save_related(request, form, formsets, change)
+        new = self.ingredient_amounts(recipe)
+        ShoppingListItem.objects.apply(
+            ShoppingCart.objects.filter(recipe=recipe).values_list(
+                "user_id", flat=True),
+            {
+                ingredient: new.get(ingredient, 0) - old.get(ingredient, 0)
+                for ingredient in old.keys() | new.keys()
+            },
+        )
+        index_recipes([recipe.pk])
@@ -0,0 +1,89 @@
+import copy
+import json
+import logging
+from urllib.parse import urlsplit
+
+from django.http import QueryDict
+from django.urls import Resolver404, resolve
+
+from recipes.cache import request_cache
+
+# Заголовки исходного запроса, которые не относятся к подзапросам: тело
+# пакета, сжатие и условные запросы. Подзапрос всегда получает JSON.
+SKIPPED_HEADERS = (
+    "CONTENT_LENGTH", "CONTENT_TYPE", "HTTP_ACCEPT_ENCODING",
+    "HTTP_IF_NONE_MATCH",
+)
+
+
+def sub_request(request, path):
+    """GET-запрос к path от имени пользователя request.
+
+    Пользователь и токен передаются через принудительную аутентификацию
+    DRF, поэтому подзапрос не проверяет токен ещё раз, а request_cache
+    у подзапроса тот же, что у пакета. Анониму принудительная
+    аутентификация не включается: с ней DRF отвечает 403 вместо 401,
+    потому что у неё нет заголовка WWW-Authenticate.
+    """
+    url = urlsplit(path)
+    sub = copy.copy(request._request)
+    sub.method = "GET"
+    sub.path = sub.path_info = url.path
+    sub.META = {
+        key: value for key, value in request.META.items()
+        if key not in SKIPPED_HEADERS
+    }
+    sub.META.update(
+        REQUEST_METHOD="GET", PATH_INFO=url.path, QUERY_STRING=url.query,
+        HTTP_ACCEPT="application/json",
+    )
+    sub.GET = QueryDict(url.query)
+    sub.user = request.user
+    if request.user.is_authenticated:
+        sub._force_auth_user = request.user
+        sub._force_auth_token = request.auth
+    else:
+        sub.__dict__.pop("_force_auth_user", None)
+        sub.__dict__.pop("_force_auth_token", None)
+    sub.request_cache = request_cache(request)
+    return sub
+
+
+def response_body(response):
+    """Тело ответа: response.data, а у готовых и потоковых ответов - JSON."""
+    if hasattr(response, "data"):
+        return response.data
+    if not response.get("Content-Type", "").startswith("application/json"):
+        return None
+    if response.streaming:
+        return json.loads(b"".join(response.streaming_content))
+    return json.loads(response.content)
+
+
+def run_one(request, path):
+    try:
+        match = resolve(urlsplit(path).path)
+    except Resolver404:
+        return {"status": 404, "body": {"detail": "Страница не найдена."}}
+    sub = sub_request(request, path)
+    sub.resolver_match = match
+    response = match.func(sub, *match.args, **match.kwargs)
+    return {"status": response.status_code, "body": response_body(response)}
+
+
+def run_batch(request, paths):
+    """Ответы на GET-запросы paths в виде {"status", "body"}.
+
+    Запросы выполняются по очереди view из URLconf, минуя middleware.
+    Ошибка в одном подзапросе даёт ответ со статусом 500 только для него,
+    остальные подзапросы пакета выполняются как обычно.
+    """
+    responses = []
+    for path in paths:
+        try:
+            responses.append(run_one(request, path))
+        except Exception:
+            logging.exception("ошибка в подзапросе %s", path)
+            responses.append(
+                {"status": 500, "body": {"detail": "Ошибка сервера."}})
+    return responses
@@ -0,0 +1,273 @@
+import gzip
+import hashlib
+import time
+from functools import partial
+
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse
+from django.utils.http import parse_etags, urlencode
+
+from recipes.constants import (CHANGE_LOG_TIMEOUT,
+                               RESPONSE_CACHE_POLL_INTERVAL,
+                               RESPONSE_CACHE_TIMEOUT, RESPONSE_CACHE_WAIT,
+                               RESPONSE_LOCK_TIMEOUT)
+from recipes.renderers import FastJSONRenderer
+
+
+def get_version(name):
+    return cache.get(f"{name}_version", 0)
+
+
+def get_versions(*names):
+    versions = cache.get_many([f"{name}_version" for name in names])
+    return [versions.get(f"{name}_version", 0) for name in names]
+
+
+def incr_version(name):
+    cache.add(f"{name}_version", 0, None)
+    return cache.incr(f"{name}_version")
+
+
+def bump_version(name):
+    """Сдвигает версию данных: все ключи со старой версией устаревают.
+
+    Внутри транзакции версия сдвигается после её фиксации: до фиксации
+    параллельный запрос видит старые данные и мог бы сохранить их под
+    новой версией. Вне транзакции версия сдвигается сразу.
+    """
+    transaction.on_commit(partial(incr_version, name))
+
+
+def log_changes(name, ids):
+    """Сдвигает версию name после фиксации и запоминает изменённые ids.
+
+    По журналу get_changes процессы с данными в памяти обновляют только
+    изменённые объекты, а не перечитывают всё.
+    """
+    ids = list(ids)
+
+    def log():
+        version = incr_version(name)
+        cache.set(f"{name}_changes_{version}", ids, CHANGE_LOG_TIMEOUT)
+
+    transaction.on_commit(log)
+
+
+def get_changes(name, since, version):
+    """ids, изменённые в версиях после since до version включительно.
+
+    None, если часть журнала потеряна или версия сдвинута через
+    bump_version без журнала.
+    """
+    if version < since:
+        return None
+    keys = [f"{name}_changes_{number}"
+            for number in range(since + 1, version + 1)]
+    changes = cache.get_many(keys)
+    if len(changes) != len(keys):
+        return None
+    return set().union(*changes.values())
+
+
+def invalidate_recipe(recipe_id, author_id=None):
+    """Сбрасывает ответы с рецептом после фиксации транзакции."""
+    bump_version("recipes")
+    bump_version(f"recipe_{recipe_id}")
+    if author_id is not None:
+        bump_version(f"recipes_author_{author_id}")
+
+
+def request_cache(request):
+    """Словарь, который живёт один HTTP-запрос.
+
+    Подзапросы /api/batch/ получают словарь исходного запроса, поэтому
+    всё, что в нём сохранено, считается один раз на весь пакет.
+    """
+    request = getattr(request, "_request", request)
+    if not hasattr(request, "request_cache"):
+        request.request_cache = {}
+    return request.request_cache
+
+
+def per_request(request, key, compute):
+    """Значение compute() из request_cache, считается один раз."""
+    cached = request_cache(request)
+    if key not in cached:
+        cached[key] = compute()
+    return cached[key]
+
+
+def render_cached(data):
+    body = FastJSONRenderer().render(data)
+    return (f'"{hashlib.md5(body).hexdigest()}"', body, gzip.compress(body))
+
+
+def accepts_gzip(request):
+    """Разрешает ли Accept-Encoding ответ в gzip с учётом q-значений.
+
+    gzip;q=0 запрещает сжатие, "*" задаёт качество для gzip, если он не
+    указан явно.
+    """
+    qualities = {}
+    for item in request.headers.get("Accept-Encoding", "").split(","):
+        coding, *params = (part.strip() for part in item.split(";"))
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[coding.lower()] = quality
+    return qualities.get("gzip", qualities.get("*", 0.0)) > 0
+
+
+def cached_response(request, cached):
+    etag, body, compressed = cached
+    etags = parse_etags(request.headers.get("If-None-Match", ""))
+    if etag in etags or "*" in etags:
+        response = HttpResponse(status=304)
+    elif accepts_gzip(request):
+        response = HttpResponse(compressed, content_type="application/json")
+        response["Content-Encoding"] = "gzip"
+    else:
+        response = HttpResponse(body, content_type="application/json")
+    response["ETag"] = etag
+    response["Cache-Control"] = "no-cache"
+    response["Vary"] = "Accept-Encoding"
+    return response
+
+
+def get_or_compute(key, compute, timeout=None, stale_key=None):
+    """Значение из кэша; при промахе его считает только один запрос.
+
+    Первый промахнувшийся запрос берёт блокировку через cache.add,
+    считает значение и сохраняет его под key и под stale_key без версии.
+    Остальные запросы отдают прошлое значение из stale_key, а если его
+    нет (новый ключ, сброс кэша) - ждут значение от держателя блокировки
+    до RESPONSE_CACHE_WAIT секунд и только потом считают сами.
+    """
+    keys = [key] if stale_key is None else [key, stale_key]
+    values = cache.get_many(keys)
+    if key in values:
+        return values[key]
+    lock_key = f"{key}_lock"
+    deadline = time.monotonic() + RESPONSE_CACHE_WAIT
+    while not cache.add(lock_key, 1, RESPONSE_LOCK_TIMEOUT):
+        if stale_key in values:
+            return values[stale_key]
+        if time.monotonic() >= deadline:
+            return compute()
+        time.sleep(RESPONSE_CACHE_POLL_INTERVAL)
+        values = cache.get_many([key])
+        if key in values:
+            return values[key]
+    try:
+        value = compute()
+        cache.set_many(dict.fromkeys(keys, value), timeout)
+    finally:
+        cache.delete(lock_key)
+    return value
+
+
+class CachedListMixin:
+    """Кэширует сериализованный и сжатый ответ list без параметров.
+
+    Ключ кэша содержит версию cache_version_name, поэтому для сброса
+    достаточно вызвать bump_version. Клиент с актуальным If-None-Match
+    получает 304 без тела.
+    """
+
+    cache_version_name = None
+
+    def list(self, request, *args, **kwargs):
+        if request.query_params or request.accepted_renderer.format != "json":
+            return super().list(request, *args, **kwargs)
+        stale_key = f"{self.cache_version_name}_list"
+        return cached_response(request, get_or_compute(
+            f"{stale_key}_{get_version(self.cache_version_name)}",
+            lambda: render_cached(self.get_serializer(
+                self.filter_queryset(self.get_queryset()), many=True).data),
+            stale_key=stale_key,
+        ))
+
+
+class AnonymousCacheMixin:
+    """Кэширует ответы list и retrieve для анонимных пользователей.
+
+    Анонимам флаги избранного и корзины всегда false, поэтому ответ
+    зависит только от адреса сайта и параметров из cache_query_params,
+    а запросы с другими параметрами не кэшируются. Ключ содержит версии
+    тегов и ингредиентов и версии рецептов: общую для списка, автора для
+    списка с фильтром author, рецепта и его автора для retrieve.
+    Изменение профиля автора сдвигает только версию автора, поэтому в
+    общем списке старое имя автора держится до истечения
+    RESPONSE_CACHE_TIMEOUT.
+    """
+
+    cache_query_params = ()
+
+    def cacheable(self, request):
+        return (
+            not request.user.is_authenticated
+            and request.accepted_renderer.format == "json"
+            and request.query_params.keys() <= set(self.cache_query_params)
+        )
+
+    def cache_key(self, request, name, *versions):
+        if not self.cacheable(request):
+            return None
+        query = urlencode(sorted(
+            (param, value) for param in request.query_params
+            for value in request.query_params.getlist(param)
+        ))
+        digest = hashlib.md5(
+            f"{request.build_absolute_uri('/')}?{query}".encode()
+        ).hexdigest()
+        versions = "_".join(
+            map(str, get_versions("tags", "ingredients", *versions)))
+        return f"{name}_{versions}_{digest}", f"{name}_{digest}"
+
+    def cached(self, request, keys, view, *args, **kwargs):
+        if keys is None:
+            return view(request, *args, **kwargs)
+        key, stale_key = keys
+        return cached_response(request, get_or_compute(
+            key,
+            lambda: render_cached(view(request, *args, **kwargs).data),
+            RESPONSE_CACHE_TIMEOUT,
+            stale_key,
+        ))
+
+    def list(self, request, *args, **kwargs):
+        author = request.query_params.get("author", "")
+        keys = self.cache_key(
+            request, "recipes_list",
+            f"recipes_author_{author}" if author.isdigit() else "recipes",
+        )
+        return self.cached(request, keys, super().list, *args, **kwargs)
+
+    def author_id(self, pk):
+        """Автор рецепта pk; он не меняется, поэтому кэшируется без срока."""
+        key = f"recipe_{pk}_author"
+        author_id = cache.get(key)
+        if author_id is None:
+            author_id = self.queryset.filter(pk=pk).values_list(
+                "author_id", flat=True).first()
+            if author_id is not None:
+                cache.set(key, author_id, None)
+        return author_id
+
+    def retrieve(self, request, *args, **kwargs):
+        pk = str(kwargs.get(self.lookup_field, ""))
+        keys = None
+        if pk.isdigit() and self.cacheable(request):
+            author_id = self.author_id(pk)
+            if author_id is not None:
+                keys = self.cache_key(
+                    request, f"recipes_detail_{pk}", f"recipe_{pk}",
+                    f"recipes_author_{author_id}",
+                )
+        return self.cached(request, keys, super().retrieve, *args, **kwargs)
@@ -6,3 +6,25 @@ MAX_EMAIL_LENGTH = 254
 MAX_NAMES_LENGTH = 150
 PAGE_SIZE = 6
 MIN_COOKING_TIME = 1
+INGREDIENTS_SEARCH_LIMIT = 20
+INGREDIENTS_SEARCH_MAX_LIMIT = 100
+SHOPPING_CART_CHUNK_SIZE = 2000
+STREAM_BLOCK_SIZE = 64 * 1024
+SEARCH_CONFIG = "russian"
+SEARCH_INDEX_BATCH_SIZE = 1000
+FEED_FANOUT_MAX_FOLLOWERS = 1000
+FEED_BACKFILL_SIZE = 100
+SIMILAR_RECIPES_COUNT = 10
+SIMILAR_TAG_WEIGHT = 0.5
+SIMILAR_MAX_POSTINGS = 5000
+SIMILAR_BATCH_SIZE = 1000
+PANTRY_MAX_INGREDIENTS = 100
+PANTRY_INDEX_MIN_AGE = 10
+PANTRY_INDEX_MAX_DELTA = 100
+RESPONSE_CACHE_TIMEOUT = 60 * 60
+RESPONSE_LOCK_TIMEOUT = 30
+RESPONSE_CACHE_WAIT = 1
+RESPONSE_CACHE_POLL_INTERVAL = 0.05
+CHANGE_LOG_TIMEOUT = 24 * 60 * 60
+RECIPES_BATCH_MAX_SIZE = 100
+API_BATCH_MAX_REQUESTS = 20
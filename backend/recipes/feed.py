@@ -0,0 +1,125 @@
+from collections import defaultdict
+from itertools import islice
+
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+
+from recipes.constants import FEED_BACKFILL_SIZE, FEED_FANOUT_MAX_FOLLOWERS
+from recipes.models import PopularAuthor, Recipe, TimelineEntry
+from users.models import Follow
+
+BULK_BATCH_SIZE = 1000
+
+
+def followers_exceed_limit(author_id):
+    """Подписчиков больше порога; считаются не дальше порога."""
+    return Follow.objects.filter(following_id=author_id)[
+        :FEED_FANOUT_MAX_FOLLOWERS + 1].count() > FEED_FANOUT_MAX_FOLLOWERS
+
+
+def latest_recipes(author_ids):
+    """Последние FEED_BACKFILL_SIZE рецептов каждого из авторов."""
+    return Recipe.objects.filter(author_id__in=author_ids).annotate(
+        row_number=Window(
+            RowNumber(), partition_by=F("author_id"),
+            order_by=(F("pub_date").desc(), F("id").desc()),
+        )
+    ).filter(row_number__lte=FEED_BACKFILL_SIZE).values_list(
+        "id", "author_id", "pub_date")
+
+
+def fan_out(entries):
+    """Записывает строки лент пачками по BULK_BATCH_SIZE.
+
+    bulk_create собирает весь генератор в список, поэтому он получает
+    по одной пачке, и в памяти не больше BULK_BATCH_SIZE строк.
+    """
+    entries = iter(entries)
+    while batch := list(islice(entries, BULK_BATCH_SIZE)):
+        TimelineEntry.objects.bulk_create(
+            [
+                TimelineEntry(user_id=user_id, recipe_id=recipe_id,
+                              author_id=author_id, pub_date=pub_date)
+                for user_id, recipe_id, author_id, pub_date in batch
+            ],
+            ignore_conflicts=True,
+        )
+
+
+def publish(recipes):
+    """Раскладывает новые рецепты по лентам подписчиков их авторов.
+
+    Рецепты популярных авторов не раскладываются, лента добавляет их при
+    чтении, поэтому на каждый рецепт пишется не больше
+    FEED_FANOUT_MAX_FOLLOWERS строк.
+    """
+    by_author = defaultdict(list)
+    for recipe in recipes:
+        by_author[recipe.author_id].append((recipe.id, recipe.pub_date))
+    for author_id in PopularAuthor.objects.filter(
+        author_id__in=by_author
+    ).values_list("author_id", flat=True):
+        del by_author[author_id]
+    if not by_author:
+        return
+    fan_out(
+        (follower_id, recipe_id, author_id, pub_date)
+        for follower_id, author_id in Follow.objects.filter(
+            following_id__in=by_author
+        ).values_list("follower_id", "following_id").order_by().iterator()
+        for recipe_id, pub_date in by_author[author_id]
+    )
+
+
+def follow(follower_id, author_id):
+    """Заполняет ленту нового подписчика последними рецептами автора.
+
+    Автор, у которого подписчиков стало больше порога, переходит в
+    популярные.
+    """
+    if PopularAuthor.objects.filter(author_id=author_id).exists():
+        return
+    if followers_exceed_limit(author_id):
+        PopularAuthor.objects.get_or_create(author_id=author_id)
+        return
+    fan_out(
+        (follower_id, recipe_id, author_id, pub_date)
+        for recipe_id, author_id, pub_date in latest_recipes([author_id])
+    )
+
+
+def unfollow(follower_id, author_id):
+    """Убирает рецепты автора из ленты бывшего подписчика.
+
+    Популярный автор, у которого подписчиков стало не больше порога,
+    снова раскладывает рецепты по лентам, и ленты его подписчиков
+    заполняются заново.
+    """
+    TimelineEntry.objects.filter(
+        user_id=follower_id, author_id=author_id).delete()
+    if followers_exceed_limit(author_id):
+        return
+    deleted, _ = PopularAuthor.objects.filter(author_id=author_id).delete()
+    if deleted:
+        recipes = list(latest_recipes([author_id]))
+        fan_out(
+            (user_id, recipe_id, author_id, pub_date)
+            for user_id in Follow.objects.filter(
+                following_id=author_id
+            ).values_list("follower_id", flat=True).iterator()
+            for recipe_id, _, pub_date in recipes
+        )
+
+
+def feed_entries(user):
+    """Пары (id рецепта, дата публикации) ленты, новые первыми."""
+    entries = TimelineEntry.objects.filter(user=user).values_list(
+        "recipe_id", "pub_date")
+    popular = PopularAuthor.objects.filter(
+        author__following__follower=user).values("author_id")
+    if popular.exists():
+        entries = entries.union(
+            Recipe.objects.filter(author_id__in=popular).values_list(
+                "id", "pub_date").order_by()
+        )
+    return entries.order_by("-pub_date", "-recipe_id")
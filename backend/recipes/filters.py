@@ -1,31 +1,92 @@
-from django_filters.rest_framework import (AllValuesMultipleFilter,
-                                           BooleanFilter, FilterSet, filters)
-from rest_framework.filters import SearchFilter
+from collections import defaultdict
 
-from recipes.models import Recipe
+from django.db.models import Exists, OuterRef
+from django_filters.rest_framework import (BooleanFilter, FilterSet,
+                                           MultipleChoiceFilter, filters)
+
+from recipes.cache import get_or_compute, get_version
+from recipes.models import Recipe, Tag
+from recipes.search import search_recipes
 from users.models import User
 
 
-class IngredientsSearchFilter(SearchFilter):
-    search_param = "name"
+def load_tag_ids():
+    tags = defaultdict(list)
+    for slug, pk in Tag.objects.values_list("slug", "id").order_by("id"):
+        tags[slug].append(pk)
+    return dict(tags)
+
+
+def tag_ids():
+    """Словарь slug -> список id тегов из кэша, сбрасывается версией tags.
+
+    Slug тегов не уникален, поэтому одному slug может соответствовать
+    несколько тегов.
+    """
+    return get_or_compute(
+        f"tag_ids_by_slug_{get_version('tags')}",
+        load_tag_ids,
+        stale_key="tag_ids_by_slug",
+    )
+
+
+def tag_choices():
+    return [(slug, slug) for slug in tag_ids()]
+
+
+class TagsFilter(MultipleChoiceFilter):
+    """Фильтр по slug тегов через EXISTS, без JOIN и DISTINCT.
+
+    Slug проверяются по закэшированному словарю тегов. Параметр
+    tags_mode=all оставляет рецепты со всеми тегами, по умолчанию
+    (tags_mode=any) - хотя бы с одним.
+    """
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault("choices", tag_choices)
+        super().__init__(*args, **kwargs)
+
+    def filter(self, qs, value):
+        if not value:
+            return qs
+        tags = tag_ids()
+        groups = [tags[slug] for slug in dict.fromkeys(value) if slug in tags]
+        recipe_tags = Recipe.tags.through.objects.filter(
+            recipe_id=OuterRef("pk"))
+        if self.parent.form.cleaned_data.get("tags_mode") == "all":
+            for ids in groups:
+                qs = qs.filter(Exists(recipe_tags.filter(tag_id__in=ids)))
+            return qs
+        return qs.filter(Exists(recipe_tags.filter(
+            tag_id__in=[pk for ids in groups for pk in ids])))
 
 
 class RecipeFilter(FilterSet):
     author = filters.ModelChoiceFilter(queryset=User.objects.all())
-    tags = AllValuesMultipleFilter(
-        field_name="tags__slug",)
+    tags = TagsFilter()
+    tags_mode = filters.ChoiceFilter(
+        choices=(("any", "любой из тегов"), ("all", "все теги")),
+        method="get_tags_mode",
+    )
     is_favorited = BooleanFilter(method='get_is_favorited')
     is_in_shopping_cart = BooleanFilter(method='get_is_in_shopping_cart')
+    search = filters.CharFilter(method='get_search')
 
     class Meta:
         model = Recipe
         fields = (
             "author",
             "tags",
+            "tags_mode",
             'is_favorited',
             'is_in_shopping_cart',
+            'search',
         )
 
+    def get_tags_mode(self, queryset, name, value):
+        """Режим читает фильтр tags, сам queryset не меняется."""
+        return queryset
+
     def get_is_favorited(self, queryset, name, value):
         if value and self.request.user.is_authenticated:
             return queryset.filter(favorites__user=self.request.user)
@@ -35,3 +96,6 @@ class RecipeFilter(FilterSet):
         if value and self.request.user.is_authenticated:
             return queryset.filter(shopping_carts__user=self.request.user)
         return queryset.none()
+
+    def get_search(self, queryset, name, value):
+        return search_recipes(queryset, value)
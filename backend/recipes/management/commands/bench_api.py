@@ -0,0 +1,315 @@
+import io
+import json
+import random
+import statistics
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext, override_settings
+from rest_framework.test import APIClient
+
+from recipes.cache import get_version
+from recipes.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
+                            ShoppingCart, Tag)
+from recipes.search import pantry_index
+from users.models import Follow, User
+
+IMAGE = (
+    "data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAA"
+    "DUlEQVR42mP8z8BQDwAEhQGAhKmMIQAAAABJRU5ErkJggg=="
+)
+
+BENCH_CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "bench_api",
+    }
+}
+
+# Маршрут: (название, метод, url, бюджет запросов, тело запроса). Тело -
+# число ингредиентов рецепта для создания или изменения рецепта, BATCH
+# для пачки рецептов либо COMPOSITE для подзапросов /api/batch/. Бюджет
+# считается для авторизованного пользователя, если не указано иное.
+BATCH = "batch"
+BATCH_SIZE = 20
+COMPOSITE = "composite"
+COMPOSITE_REQUESTS = (
+    "/api/users/me/", "/api/tags/", "/api/recipes/?limit={limit}",
+    "/api/recipes/{recipe}/", "/api/users/subscriptions/?limit={limit}",
+)
+ROUTES = (
+    ("recipes-list", "get", "/api/recipes/?limit={limit}", 4, None),
+    ("recipes-list-anon", "get", "/api/recipes/?limit={limit}", 4, None),
+    ("recipes-list-anon-cached", "get", "/api/recipes/?limit={limit}", 0,
+     None),
+    ("recipes-list-cards", "get",
+     "/api/recipes/?limit={limit}&fields=id,name,image,cooking_time,tags", 3,
+     None),
+    ("recipes-list-cursor", "get", "/api/recipes/?limit={limit}&cursor=", 3,
+     None),
+    # Первый запрос с тегами заполняет кэш словаря тегов.
+    ("recipes-list-tags", "get",
+     "/api/recipes/?limit={limit}&tags=bench_tag_0&tags=bench_tag_1", 5,
+     None),
+    ("recipes-list-tags-all", "get",
+     "/api/recipes/?limit={limit}&tags=bench_tag_0&tags=bench_tag_1"
+     "&tags_mode=all", 4, None),
+    ("recipes-search", "get",
+     "/api/recipes/?limit={limit}&search=bench_ingredient_1", 4, None),
+    ("recipes-feed", "get", "/api/recipes/feed/?limit={limit}", 7, None),
+    ("recipes-detail", "get", "/api/recipes/{recipe}/", 4, None),
+    ("recipes-detail-anon", "get", "/api/recipes/{recipe}/", 4, None),
+    ("recipes-detail-anon-cached", "get", "/api/recipes/{recipe}/", 0,
+     None),
+    ("recipes-pantry", "get",
+     "/api/recipes/pantry/?limit={limit}&missing=8&ingredients={pantry}", 4,
+     None),
+    ("recipes-batch", "get", "/api/recipes/batch/?ids={batch}", 3, None),
+    # Сумма бюджетов подзапросов; /api/tags/ в пакете заполняет кэш тегов.
+    ("api-batch", "post", "/api/batch/", 13, COMPOSITE),
+    ("recipes-similar", "get", "/api/recipes/{recipe}/similar/", 2, None),
+    ("recipes-create-small", "post", "/api/recipes/", 24, 3),
+    ("recipes-create-large", "post", "/api/recipes/", 24, 25),
+    ("recipes-update-small", "patch", "/api/recipes/{own_recipe}/", 30, 3),
+    ("recipes-update-large", "patch", "/api/recipes/{own_recipe}/", 30, 25),
+    ("favorite-add", "post", "/api/recipes/{recipe}/favorite/", 2, None),
+    ("favorite-delete", "delete", "/api/recipes/{recipe}/favorite/", 1,
+     None),
+    ("favorite-batch-add", "post", "/api/recipes/favorite/", 1, BATCH),
+    ("favorite-batch-delete", "delete", "/api/recipes/favorite/", 1, BATCH),
+    ("shopping-cart-add", "post", "/api/recipes/{recipe}/shopping_cart/", 9,
+     None),
+    ("shopping-cart-delete", "delete",
+     "/api/recipes/{recipe}/shopping_cart/", 8, None),
+    ("shopping-cart-batch-add", "post", "/api/recipes/shopping_cart/", 8,
+     BATCH),
+    ("shopping-cart-batch-delete", "delete", "/api/recipes/shopping_cart/",
+     8, BATCH),
+    ("download-shopping-cart", "get",
+     "/api/recipes/download_shopping_cart/", 1, None),
+    ("users-list", "get", "/api/users/?limit={limit}", 2, None),
+    ("users-detail", "get", "/api/users/{author}/", 1, None),
+    ("users-me", "get", "/api/users/me/", 1, None),
+    ("subscriptions", "get",
+     "/api/users/subscriptions/?limit={limit}&recipes_limit=3", 3, None),
+    ("subscribe", "post", "/api/users/{author}/subscribe/", 15, None),
+    ("unsubscribe", "delete", "/api/users/{author}/subscribe/", 9, None),
+    ("ingredients", "get", "/api/ingredients/?name={prefix}", 1, None),
+    ("tags", "get", "/api/tags/", 1, None),
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Наполняет базу тестовыми данными, вызывает каждый маршрут API и "
+        "сверяет число запросов к базе с бюджетом маршрута. Все изменения "
+        "откатываются по завершении."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=30)
+        parser.add_argument("--recipes", type=int, default=120)
+        parser.add_argument("--ingredients", type=int, default=300)
+        parser.add_argument("--limit", type=int, default=6)
+        parser.add_argument("--repeat", type=int, default=5,
+                            help="повторы GET-запросов для замера времени")
+        parser.add_argument("--seed", type=int, default=42)
+        parser.add_argument("--output", type=str,
+                            help="файл для сохранения результатов в JSON")
+
+    def handle(self, *args, **options):
+        # Свой кэш в памяти: данные замера откатываются, и их ответы не
+        # должны попасть в общий кэш сервера.
+        with tempfile.TemporaryDirectory() as media_root, override_settings(
+            MEDIA_ROOT=media_root, CACHES=BENCH_CACHES,
+        ), transaction.atomic():
+            context = self.seed(options)
+            results = [
+                self.run_route(route, context, options) for route in ROUTES
+            ]
+            transaction.set_rollback(True)
+        self.report(results)
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8") as file:
+                json.dump(results, file, ensure_ascii=False, indent=2)
+        failed = [result["route"] for result in results if result["failed"]]
+        if failed:
+            raise CommandError(
+                "Маршруты не уложились в бюджет: " + ", ".join(failed))
+
+    def seed(self, options):
+        rnd = random.Random(options["seed"])
+        users = User.objects.bulk_create(
+            User(
+                username=f"bench_user_{number}",
+                email=f"bench_user_{number}@example.com",
+                first_name="Имя",
+                last_name="Фамилия",
+            )
+            for number in range(options["users"])
+        )
+        tags = Tag.objects.bulk_create(
+            Tag(name=f"bench_tag_{number}", color=f"#b{number:05x}",
+                slug=f"bench_tag_{number}")
+            for number in range(5)
+        )
+        ingredients = Ingredient.objects.bulk_create(
+            Ingredient(name=f"bench_ingredient_{number}",
+                       measurement_unit="г")
+            for number in range(options["ingredients"])
+        )
+        authors = users[:max(len(users) // 3, 1)]
+        recipes = Recipe.objects.bulk_create(
+            Recipe(
+                author=rnd.choice(authors),
+                name=f"bench_recipe_{number}",
+                text="Описание рецепта " * 20,
+                cooking_time=rnd.randint(5, 120),
+            )
+            for number in range(options["recipes"])
+        )
+        Recipe.tags.through.objects.bulk_create(
+            Recipe.tags.through(recipe=recipe, tag=tag)
+            for recipe in recipes
+            for tag in rnd.sample(tags, rnd.randint(1, 3))
+        )
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(recipe=recipe, ingredient=ingredient,
+                             amount=rnd.randint(1, 500))
+            for recipe in recipes
+            for ingredient in rnd.sample(ingredients, rnd.randint(3, 12))
+        )
+        user = users[-1]
+        Favorite.objects.bulk_create(
+            Favorite(user=user, recipe=recipe)
+            for recipe in rnd.sample(recipes, len(recipes) // 4)
+        )
+        ShoppingCart.objects.bulk_create(
+            ShoppingCart(user=user, recipe=recipe)
+            for recipe in rnd.sample(recipes, len(recipes) // 10)
+        )
+        Follow.objects.bulk_create(
+            Follow(follower=user, following=author)
+            for author in authors[1:]
+        )
+        call_command("rebuild_shopping_lists", stdout=io.StringIO())
+        call_command("rebuild_search_index", stdout=io.StringIO())
+        call_command("rebuild_feeds", stdout=io.StringIO())
+        call_command("compute_similar_recipes", "--full",
+                     stdout=io.StringIO())
+        # Фоновая сборка индекса не видит данные незафиксированной
+        # транзакции замера, поэтому индекс строится здесь же.
+        pantry_index.build(get_version("recipe_ingredients"))
+        own_recipe = Recipe.objects.create(
+            author=user, name="bench_own_recipe", text="Описание",
+            cooking_time=10,
+        )
+        own_recipe.tags.set(tags[:1])
+        batch = [
+            recipe.id for recipe in rnd.sample(
+                recipes, min(BATCH_SIZE, len(recipes)))
+        ]
+        client = APIClient(HTTP_HOST=settings.ALLOWED_HOSTS[0])
+        client.force_authenticate(user)
+        return {
+            "client": client,
+            "anon_client": APIClient(HTTP_HOST=settings.ALLOWED_HOSTS[0]),
+            "rnd": rnd,
+            "batch": batch,
+            "tags": tags,
+            "ingredients": ingredients,
+            "urls": {
+                "limit": options["limit"],
+                "recipe": next(
+                    recipe.id for recipe in recipes
+                    if not user.favorites.filter(recipe=recipe).exists()
+                    and not user.shopping_carts.filter(recipe=recipe).exists()
+                ),
+                "own_recipe": own_recipe.id,
+                "author": authors[0].id,
+                "prefix": ingredients[0].name[:-1],
+                "batch": ",".join(map(str, batch)),
+                "pantry": ",".join(
+                    str(ingredient.id) for ingredient in ingredients[:30]),
+            },
+        }
+
+    def recipe_data(self, context, ingredients_count):
+        rnd = context["rnd"]
+        return {
+            "name": f"bench_new_recipe_{rnd.getrandbits(32)}",
+            "text": "Описание",
+            "cooking_time": 15,
+            "image": IMAGE,
+            "tags": [tag.id for tag in rnd.sample(context["tags"], 2)],
+            "ingredients": [
+                {"id": ingredient.id, "amount": rnd.randint(1, 500)}
+                for ingredient in rnd.sample(
+                    context["ingredients"], ingredients_count)
+            ],
+        }
+
+    def request(self, client, method, url, data):
+        start = time.perf_counter()
+        response = getattr(client, method)(url, data=data, format="json")
+        if response.streaming:
+            size = sum(len(chunk) for chunk in response.streaming_content)
+        else:
+            size = len(response.content)
+        return response, size, (time.perf_counter() - start) * 1000
+
+    def run_route(self, route, context, options):
+        name, method, url, budget, body = route
+        url = url.format(**context["urls"])
+        client = context[
+            "anon_client" if "-anon" in name else "client"]
+        if body == BATCH:
+            data = {"recipes": context["batch"]}
+        elif body == COMPOSITE:
+            data = {"requests": [
+                path.format(**context["urls"]) for path in COMPOSITE_REQUESTS
+            ]}
+        elif body:
+            data = self.recipe_data(context, body)
+        else:
+            data = None
+        with CaptureQueriesContext(connection) as queries:
+            response, size, elapsed = self.request(client, method, url, data)
+        count = len(queries)
+        timings = [elapsed]
+        if response.status_code >= 400:
+            self.stderr.write(f"{name}: {response.content[:500]!r}")
+        if method == "get":
+            timings += [
+                self.request(client, method, url, data)[2]
+                for _ in range(options["repeat"] - 1)
+            ]
+        return {
+            "route": name,
+            "method": method.upper(),
+            "url": url,
+            "status": response.status_code,
+            "queries": count,
+            "budget": budget,
+            "failed": count > budget or response.status_code >= 400,
+            "time_ms": round(statistics.median(timings), 2),
+            "size": size,
+        }
+
+    def report(self, results):
+        self.stdout.write(
+            f"{'маршрут':<28}{'статус':>7}{'запросы':>9}{'бюджет':>8}"
+            f"{'мс':>10}{'байт':>10}"
+        )
+        for result in results:
+            line = (
+                f"{result['route']:<28}{result['status']:>7}"
+                f"{result['queries']:>9}{result['budget']:>8}"
+                f"{result['time_ms']:>10}{result['size']:>10}"
+            )
+            self.stdout.write(
+                self.style.ERROR(line) if result["failed"] else line)
@@ -0,0 +1,100 @@
+import itertools
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Min
+
+from recipes.constants import SIMILAR_RECIPES_COUNT
+from recipes.models import SimilarRecipe, StaleSimilarRecipe
+from recipes.similarity import SimilarityMatrix, batches
+
+
+class Command(BaseCommand):
+    help = (
+        "Пересчитывает списки похожих рецептов. По умолчанию только для "
+        "рецептов, изменённых после прошлого запуска, и для рецептов, чьи "
+        "списки эти изменения затрагивают; с --full - для всех рецептов."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--full", action="store_true",
+                            help="пересчитать все списки")
+        parser.add_argument("--batch-size", type=int, default=1_000)
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        self.batch_size = options["batch_size"]
+        if options["full"]:
+            matrix = SimilarityMatrix()
+            StaleSimilarRecipe.objects.all().delete()
+            with transaction.atomic():
+                SimilarRecipe.objects.all().delete()
+                self.write(matrix, matrix.ingredients)
+            count = len(matrix.ingredients)
+        else:
+            stale = list(StaleSimilarRecipe.objects.values_list(
+                "recipe_id", flat=True))
+            # Очередь разбирается до расчёта: рецепт, изменённый во время
+            # расчёта, снова попадёт в следующий запуск.
+            for batch in batches(stale, self.batch_size):
+                StaleSimilarRecipe.objects.filter(
+                    recipe_id__in=batch).delete()
+            matrix = SimilarityMatrix(stale)
+            affected = self.affected(matrix, stale)
+            matrix.load_neighbourhood(affected)
+            for batch in batches(affected, self.batch_size):
+                with transaction.atomic():
+                    SimilarRecipe.objects.filter(
+                        recipe_id__in=batch).delete()
+                    self.write(matrix, batch)
+            count = len(affected)
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f"Похожие рецепты пересчитаны для {count} рецептов "
+            f"за {elapsed:.1f} с"
+        ))
+
+    def affected(self, matrix, stale):
+        """Изменённые рецепты и те, в чьих списках они есть или будут.
+
+        Пороги списков читаются только для рецептов с общими с
+        изменёнными ингредиентами. Кандидаты, которые появились или
+        пропали из-за перехода ингредиента через SIMILAR_MAX_POSTINGS,
+        учитываются только при запуске с --full.
+        """
+        scores = {recipe_id: matrix.scores(recipe_id) for recipe_id in stale}
+        candidates = {
+            other_id for recipe_scores in scores.values()
+            for other_id in recipe_scores
+        }
+        thresholds = {}
+        for batch in batches(sorted(candidates), self.batch_size):
+            thresholds.update(
+                (recipe_id, (count, lowest))
+                for recipe_id, count, lowest in SimilarRecipe.objects.filter(
+                    recipe_id__in=batch
+                ).values("recipe_id").annotate(
+                    count=Count("id"), lowest=Min("score")
+                ).values_list("recipe_id", "count", "lowest").order_by()
+            )
+        affected = set(stale)
+        for recipe_scores in scores.values():
+            for other_id, score in recipe_scores.items():
+                count, lowest = thresholds.get(other_id, (0, 0.0))
+                if count < SIMILAR_RECIPES_COUNT or score >= lowest:
+                    affected.add(other_id)
+        for batch in batches(stale, self.batch_size):
+            affected.update(SimilarRecipe.objects.filter(
+                similar_id__in=batch).values_list("recipe_id", flat=True))
+        return sorted(affected)
+
+    def write(self, matrix, recipe_ids):
+        rows = (
+            SimilarRecipe(recipe_id=recipe_id, similar_id=other_id,
+                          score=score)
+            for recipe_id in recipe_ids
+            for score, other_id in matrix.top(recipe_id)
+        )
+        while batch := list(itertools.islice(rows, self.batch_size)):
+            SimilarRecipe.objects.bulk_create(batch)
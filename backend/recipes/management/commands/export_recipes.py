@@ -0,0 +1,81 @@
+import json
+import sys
+import time
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+
+from recipes.models import Recipe, RecipeIngredient
+
+
+class Command(BaseCommand):
+    help = (
+        "Выгружает рецепты с тегами, ингредиентами, автором и путём к "
+        "картинке в NDJSON: по одному рецепту в строке."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("filename", nargs="?", default="-",
+                            help="файл для выгрузки, по умолчанию stdout")
+        parser.add_argument("--batch-size", type=int, default=1_000)
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        if options["filename"] == "-":
+            count = self.export(sys.stdout, options["batch_size"])
+        else:
+            with open(options["filename"], "w", encoding="utf-8") as file:
+                count = self.export(file, options["batch_size"])
+        elapsed = time.perf_counter() - start
+        self.stderr.write(
+            f"Выгружено рецептов: {count} за {elapsed:.1f} с "
+            f"({count / max(elapsed, 1e-9):.0f} строк/с)"
+        )
+
+    def batches(self, batch_size):
+        """Рецепты пачками по возрастанию id, без OFFSET."""
+        last_id = 0
+        while batch := list(
+            Recipe.objects.filter(id__gt=last_id).order_by("id").values(
+                "id", "name", "text", "cooking_time", "pub_date", "image",
+                "author__username",
+            )[:batch_size]
+        ):
+            yield batch
+            last_id = batch[-1]["id"]
+
+    def export(self, file, batch_size):
+        count = 0
+        for batch in self.batches(batch_size):
+            ids = [recipe["id"] for recipe in batch]
+            tags = defaultdict(list)
+            # Slug тега не уникален, поэтому теги выгружаются по названию.
+            for recipe_id, name in Recipe.tags.through.objects.filter(
+                recipe_id__in=ids
+            ).values_list("recipe_id", "tag__name").order_by("tag__name"):
+                tags[recipe_id].append(name)
+            ingredients = defaultdict(list)
+            for recipe_id, name, unit, amount in (
+                RecipeIngredient.objects.filter(recipe_id__in=ids)
+                .values_list("recipe_id", "ingredient__name",
+                             "ingredient__measurement_unit", "amount")
+                .order_by("id")
+            ):
+                ingredients[recipe_id].append({
+                    "name": name, "measurement_unit": unit, "amount": amount,
+                })
+            file.writelines(
+                json.dumps({
+                    "name": recipe["name"],
+                    "author": recipe["author__username"],
+                    "text": recipe["text"],
+                    "cooking_time": recipe["cooking_time"],
+                    "pub_date": recipe["pub_date"].isoformat(),
+                    "image": recipe["image"],
+                    "tags": tags[recipe["id"]],
+                    "ingredients": ingredients[recipe["id"]],
+                }, ensure_ascii=False) + "\n"
+                for recipe in batch
+            )
+            count += len(batch)
+        return count
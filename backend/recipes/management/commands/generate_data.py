@@ -0,0 +1,208 @@
+import itertools
+import logging
+import random
+import time
+from array import array
+from bisect import bisect
+from datetime import timedelta
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from recipes.cache import bump_version
+from recipes.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
+                            ShoppingCart, Tag)
+from users.models import Follow, User
+
+
+class ZipfChoice:
+    """Выбор элемента с вероятностью, убывающей по закону Ципфа.
+
+    Первые элементы последовательности выбираются чаще всего: так
+    распределены авторы-активисты и популярные рецепты.
+    """
+
+    def __init__(self, rnd, items, exponent):
+        self.rnd = rnd
+        self.items = items
+        self.cum_weights = list(itertools.accumulate(
+            1 / rank ** exponent for rank in range(1, len(items) + 1)
+        ))
+        self.total = self.cum_weights[-1]
+
+    def __call__(self):
+        return self.items[bisect(
+            self.cum_weights, self.rnd.random() * self.total,
+            0, len(self.items) - 1,
+        )]
+
+    def sample(self, count):
+        chosen = set()
+        while len(chosen) < min(count, len(self.items)):
+            chosen.add(self())
+        return chosen
+
+
+class Command(BaseCommand):
+    help = (
+        "Наполняет базу синтетическими пользователями, рецептами, тегами, "
+        "избранным, списками покупок и подписками для нагрузочного "
+        "тестирования."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=10_000)
+        parser.add_argument("--recipes", type=int, default=100_000)
+        parser.add_argument("--tags", type=int, default=10)
+        parser.add_argument("--favorites", type=int, default=500_000)
+        parser.add_argument("--carts", type=int, default=100_000)
+        parser.add_argument("--follows", type=int, default=100_000)
+        parser.add_argument("--min-ingredients", type=int, default=3)
+        parser.add_argument("--max-ingredients", type=int, default=15)
+        parser.add_argument("--authors-share", type=float, default=0.1,
+                            help="доля пользователей, публикующих рецепты")
+        parser.add_argument("--days", type=int, default=365,
+                            help="за сколько дней распределить публикации")
+        parser.add_argument("--batch-size", type=int, default=5_000)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--prefix", type=str, default="gen",
+                            help="префикс имён, должен быть уникален "
+                                 "для каждого запуска")
+
+    def handle(self, *args, **options):
+        self.batch_size = options["batch_size"]
+        self.rnd = random.Random(options["seed"])
+        prefix = options["prefix"]
+        logging.info("генерация данных запустилась")
+
+        ingredient_ids = array(
+            "q", Ingredient.objects.values_list("id", flat=True))
+        if not ingredient_ids:
+            raise CommandError(
+                "Ингредиенты не загружены, выполните loads_ingredients")
+        tag_ids = self.create_tags(prefix, options["tags"])
+        bump_version("tags")
+        user_ids = self.create_users(prefix, options["users"])
+        authors = user_ids[:max(
+            int(len(user_ids) * options["authors_share"]), 1)]
+        recipe_ids = self.create_recipes(prefix, authors, options)
+        self.create_recipe_relations(
+            recipe_ids, tag_ids, ingredient_ids, options)
+
+        popular_recipes = ZipfChoice(self.rnd, recipe_ids, 1.1)
+        self.bulk(Favorite, (
+            Favorite(user_id=self.rnd.choice(user_ids),
+                     recipe_id=popular_recipes())
+            for _ in range(options["favorites"])
+        ))
+        self.bulk(ShoppingCart, (
+            ShoppingCart(user_id=self.rnd.choice(user_ids),
+                         recipe_id=popular_recipes())
+            for _ in range(options["carts"])
+        ))
+        popular_authors = ZipfChoice(self.rnd, authors, 1.2)
+        follows = (
+            Follow(follower_id=self.rnd.choice(user_ids),
+                   following_id=popular_authors())
+            for _ in range(options["follows"])
+        )
+        self.bulk(Follow, (
+            follow for follow in follows
+            if follow.follower_id != follow.following_id
+        ))
+        bump_version("recipe_ingredients")
+        call_command("rebuild_shopping_lists", stdout=self.stdout)
+        call_command("rebuild_search_index", stdout=self.stdout)
+        call_command("rebuild_feeds", stdout=self.stdout)
+        call_command("compute_similar_recipes", "--full", stdout=self.stdout)
+
+    def bulk(self, model, rows, returning=False):
+        """Пишет строки пачками, при returning возвращает их ключи.
+
+        Без returning повторы (уже существующие пары) пропускаются, а
+        bulk_create с ignore_conflicts не сообщает, какие строки
+        вставлены, поэтому число новых строк считается по таблице.
+        """
+        ids = array("q")
+        count = 0
+        before = None if returning else model.objects.count()
+        start = time.perf_counter()
+        while batch := list(itertools.islice(rows, self.batch_size)):
+            created = model.objects.bulk_create(
+                batch, ignore_conflicts=not returning)
+            count += len(batch)
+            if returning:
+                ids.extend(obj.pk for obj in created)
+        elapsed = time.perf_counter() - start
+        inserted = count if returning else model.objects.count() - before
+        skipped = f", повторов пропущено: {count - inserted}" if (
+            inserted != count) else ""
+        self.stdout.write(
+            f"{model._meta.verbose_name}: {inserted} строк за {elapsed:.1f} с "
+            f"({count / max(elapsed, 1e-9):.0f} строк/с){skipped}"
+        )
+        return ids
+
+    def create_tags(self, prefix, count):
+        return self.bulk(Tag, (
+            Tag(
+                name=f"{prefix} тег {number}",
+                color=f"#{self.rnd.getrandbits(24):06X}",
+                slug=f"{prefix}-tag-{number}",
+            )
+            for number in range(count)
+        ), returning=True)
+
+    def create_users(self, prefix, count):
+        return self.bulk(User, (
+            User(
+                username=f"{prefix}_user_{number}",
+                email=f"{prefix}_user_{number}@example.com",
+                first_name="Имя",
+                last_name="Фамилия",
+                password="!",
+            )
+            for number in range(count)
+        ), returning=True)
+
+    def create_recipes(self, prefix, authors, options):
+        prolific_authors = ZipfChoice(self.rnd, authors, 1.0)
+        recipe_ids = self.bulk(Recipe, (
+            Recipe(
+                author_id=prolific_authors(),
+                name=f"{prefix} рецепт {number}",
+                text="Описание рецепта. " * self.rnd.randint(5, 60),
+                cooking_time=self.rnd.randint(5, 180),
+            )
+            for number in range(options["recipes"])
+        ), returning=True)
+        # auto_now_add перезаписывает дату при вставке, поэтому
+        # распределяем даты публикации отдельным проходом.
+        now = timezone.now()
+        seconds = options["days"] * 24 * 60 * 60
+        recipes = (
+            Recipe(id=recipe_id, pub_date=now - timedelta(
+                seconds=self.rnd.randrange(seconds)))
+            for recipe_id in recipe_ids
+        )
+        while batch := list(itertools.islice(recipes, self.batch_size)):
+            Recipe.objects.bulk_update(batch, ["pub_date"])
+        return recipe_ids
+
+    def create_recipe_relations(self, recipe_ids, tag_ids, ingredient_ids,
+                                options):
+        self.bulk(Recipe.tags.through, (
+            Recipe.tags.through(recipe_id=recipe_id, tag_id=tag_id)
+            for recipe_id in recipe_ids
+            for tag_id in self.rnd.sample(
+                tag_ids, self.rnd.randint(1, min(3, len(tag_ids))))
+        ))
+        popular_ingredients = ZipfChoice(self.rnd, ingredient_ids, 0.8)
+        self.bulk(RecipeIngredient, (
+            RecipeIngredient(recipe_id=recipe_id, ingredient_id=ingredient_id,
+                             amount=self.rnd.randint(1, 1000))
+            for recipe_id in recipe_ids
+            for ingredient_id in popular_ingredients.sample(self.rnd.randint(
+                options["min_ingredients"], options["max_ingredients"]))
+        ))
@@ -1,34 +1,137 @@
+import csv
+import itertools
 import json
 import logging
 import os
+import re
+import time
 
 from django.conf import settings
 from django.core.management.base import BaseCommand, CommandError
-from django.db import IntegrityError
 
+from recipes.cache import bump_version
 from recipes.models import Ingredient
 
 DATA_ROOT = os.path.join(settings.BASE_DIR, 'data')
+FIELDS = ('name', 'measurement_unit')
+READ_SIZE = 64 * 1024
+SEPARATOR = re.compile(r'\s*,?\s*')
+
+
+def read_json(file):
+    """По одному отдаёт объекты из JSON-массива, не читая файл целиком.
+
+    Разбор идёт по позиции в буфере, а прочитанная часть буфера
+    отбрасывается один раз на каждый прочитанный блок файла.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    started = False
+    eof = False
+    while True:
+        position = SEPARATOR.match(buffer, position).end()
+        if not started and position < len(buffer):
+            if buffer[position] != '[':
+                raise ValueError('ожидается JSON-массив')
+            position += 1
+            started = True
+            continue
+        if buffer.startswith(']', position):
+            return
+        if position < len(buffer):
+            try:
+                item, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            else:
+                yield item
+                position = end
+                continue
+        if eof:
+            raise ValueError('JSON-массив не закрыт')
+        chunk = file.read(READ_SIZE)
+        eof = not chunk
+        buffer = buffer[position:] + chunk
+        position = 0
+
+
+def read_csv(file):
+    """Строки CSV вида «название,единица»; строка заголовка пропускается."""
+    for row in csv.reader(file):
+        if not row or tuple(row) == FIELDS:
+            continue
+        if len(row) != len(FIELDS):
+            raise ValueError(f'ожидается два столбца, получено: {row}')
+        yield dict(zip(FIELDS, row))
+
+
+READERS = {'json': read_json, 'csv': read_csv}
 
 
 class Command(BaseCommand):
+    help = (
+        'Загружает ингредиенты из JSON или CSV пачками. Уже загруженные '
+        'ингредиенты пропускаются, поэтому команду можно запускать повторно.'
+    )
 
     def add_arguments(self, parser):
         parser.add_argument('filename', default='ingredients.json', nargs='?',
                             type=str)
+        parser.add_argument('--format', choices=READERS,
+                            help='формат файла, по умолчанию по расширению')
+        parser.add_argument('--batch-size', type=int, default=1_000)
 
     def handle(self, *args, **options):
         logging.info('скрипт переноса в бд запустился')
+        filename = options.get('filename')
+        file_format = options['format'] or os.path.splitext(
+            filename)[1].lstrip('.').lower()
+        if file_format not in READERS:
+            raise CommandError(
+                'Не удалось определить формат файла, укажите --format')
+        start = time.perf_counter()
         try:
-            with open(os.path.join(DATA_ROOT, options.get('filename')), 'r',
-                      encoding='utf-8') as file_data_json:
-                data_ingredient = json.load(file_data_json)
+            with open(os.path.join(DATA_ROOT, filename), 'r',
+                      encoding='utf-8', newline='') as file:
                 logging.info('Загрузка ингредиентов началась')
-                try:
-                    Ingredient.objects.bulk_create(
-                        Ingredient(**items) for items in data_ingredient
-                    )
-                except IntegrityError:
-                    logging.info('Ингредиенты уже были загружены')
+                inserted, skipped = self.load(
+                    READERS[file_format](file), options['batch_size'])
         except FileNotFoundError as err:
             raise CommandError('Файл отсутствует в директории data') from err
+        except (ValueError, KeyError, TypeError) as err:
+            raise CommandError(f'Некорректный файл: {err!r}') from err
+        if inserted:
+            bump_version('ingredients')
+        elapsed = time.perf_counter() - start
+        total = inserted + skipped
+        self.stdout.write(
+            f'Добавлено: {inserted}, пропущено: {skipped} '
+            f'за {elapsed:.1f} с ({total / max(elapsed, 1e-9):.0f} строк/с)'
+        )
+
+    def load(self, items, batch_size):
+        keys = (
+            (item['name'].strip(), item['measurement_unit'].strip())
+            for item in items
+        )
+        total = 0
+        before = Ingredient.objects.count()
+        while batch := list(itertools.islice(keys, batch_size)):
+            unique = dict.fromkeys(batch)
+            existing = set(Ingredient.objects.filter(
+                name__in={name for name, _ in unique}
+            ).values_list(*FIELDS))
+            # ignore_conflicts страхует от параллельной загрузки того же
+            # файла: такие строки попадут в базу один раз.
+            Ingredient.objects.bulk_create(
+                (Ingredient(name=name, measurement_unit=unit)
+                 for name, unit in unique if (name, unit) not in existing),
+                ignore_conflicts=True,
+            )
+            total += len(batch)
+        # bulk_create с ignore_conflicts не сообщает, какие строки
+        # вставлены, поэтому добавленные считаются по числу строк.
+        inserted = Ingredient.objects.count() - before
+        return inserted, total - inserted
@@ -0,0 +1,59 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+
+from recipes.constants import FEED_FANOUT_MAX_FOLLOWERS
+from recipes.feed import fan_out, latest_recipes
+from recipes.models import PopularAuthor, TimelineEntry
+from users.models import Follow
+
+
+class Command(BaseCommand):
+    help = (
+        "Пересобирает ленты подписок: отмечает популярных авторов и "
+        "раскладывает последние рецепты остальных авторов по лентам их "
+        "подписчиков."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500,
+                            help="сколько авторов обрабатывать за раз")
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        authors = Follow.objects.values("following_id").annotate(
+            followers=Count("id")).order_by("following_id").values_list(
+            "following_id", "followers")
+        with transaction.atomic():
+            TimelineEntry.objects.all().delete()
+            PopularAuthor.objects.all().delete()
+            popular, batch = [], []
+            for author_id, followers in authors.iterator():
+                if followers > FEED_FANOUT_MAX_FOLLOWERS:
+                    popular.append(PopularAuthor(author_id=author_id))
+                    continue
+                batch.append(author_id)
+                if len(batch) == options["batch_size"]:
+                    self.fan_out_authors(batch)
+                    batch = []
+            self.fan_out_authors(batch)
+            PopularAuthor.objects.bulk_create(popular)
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f"Ленты пересобраны: {TimelineEntry.objects.count()} записей, "
+            f"популярных авторов: {len(popular)} за {elapsed:.1f} с"
+        ))
+
+    def fan_out_authors(self, author_ids):
+        recipes = {}
+        for recipe_id, author_id, pub_date in latest_recipes(author_ids):
+            recipes.setdefault(author_id, []).append((recipe_id, pub_date))
+        fan_out(
+            (follower_id, recipe_id, author_id, pub_date)
+            for follower_id, author_id in Follow.objects.filter(
+                following_id__in=author_ids
+            ).values_list("follower_id", "following_id").order_by().iterator()
+            for recipe_id, pub_date in recipes.get(author_id, ())
+        )
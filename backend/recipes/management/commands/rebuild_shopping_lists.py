@@ -0,0 +1,69 @@
+import itertools
+import logging
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Sum
+
+from recipes.models import RecipeIngredient, ShoppingListItem
+
+KEY_FIELDS = ("user_id", "ingredient_id")
+
+
+class Command(BaseCommand):
+    help = (
+        "Сверяет списки покупок с корзинами пользователей и пересобирает "
+        "их с нуля."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--check", action="store_true",
+                            help="только сверить, не пересобирая")
+        parser.add_argument("--batch-size", type=int, default=5_000)
+
+    def expected(self):
+        return RecipeIngredient.objects.filter(
+            recipe__shopping_carts__isnull=False
+        ).values_list(
+            "recipe__shopping_carts__user", "ingredient"
+        ).annotate(total=Sum("amount")).order_by(
+            "recipe__shopping_carts__user", "ingredient"
+        )
+
+    def count_mismatches(self):
+        """Сравнивает отсортированные по ключу потоки слиянием."""
+        expected = self.expected().iterator()
+        actual = ShoppingListItem.objects.values_list(
+            *KEY_FIELDS, "amount").order_by(*KEY_FIELDS).iterator()
+        mismatches = 0
+        left, right = next(expected, None), next(actual, None)
+        while left is not None or right is not None:
+            if right is None or left is not None and left[:2] < right[:2]:
+                mismatches += 1
+                left = next(expected, None)
+            elif left is None or right[:2] < left[:2]:
+                mismatches += 1
+                right = next(actual, None)
+            else:
+                mismatches += left[2] != right[2]
+                left, right = next(expected, None), next(actual, None)
+        return mismatches
+
+    def handle(self, *args, **options):
+        mismatches = self.count_mismatches()
+        self.stdout.write(f"Расхождений в списках покупок: {mismatches}")
+        if options["check"] or not mismatches:
+            return
+        logging.info("пересборка списков покупок началась")
+        rows = (
+            ShoppingListItem(user_id=user_id, ingredient_id=ingredient_id,
+                             amount=total)
+            for user_id, ingredient_id, total in self.expected().iterator()
+        )
+        with transaction.atomic():
+            ShoppingListItem.objects.all().delete()
+            while batch := list(itertools.islice(
+                rows, options["batch_size"]
+            )):
+                ShoppingListItem.objects.bulk_create(batch)
+        self.stdout.write(self.style.SUCCESS("Списки покупок пересобраны"))
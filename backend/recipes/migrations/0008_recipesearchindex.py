@@ -0,0 +1,89 @@
+# Generated by Django 5.0.6 on 2026-10-18 20:30
+
+from collections import defaultdict
+
+import django.contrib.postgres.search
+import django.db.models.deletion
+from django.db import migrations, models
+
+FTS_TABLE = 'recipes_recipesearch_fts'
+
+
+def create_search_backend(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute(
+            'CREATE INDEX recipes_search_vector_gin '
+            'ON recipes_recipesearchindex USING gin (vector)'
+        )
+    elif vendor == 'sqlite':
+        schema_editor.execute(
+            f'CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(name, body)')
+
+
+def drop_search_backend(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX recipes_search_vector_gin')
+    elif vendor == 'sqlite':
+        schema_editor.execute(f'DROP TABLE {FTS_TABLE}')
+
+
+def fill_search_index(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    RecipeIngredient = apps.get_model('recipes', 'RecipeIngredient')
+    RecipeSearchIndex = apps.get_model('recipes', 'RecipeSearchIndex')
+    ingredients = defaultdict(list)
+    for recipe_id, name in RecipeIngredient.objects.values_list(
+        'recipe_id', 'ingredient__name'
+    ).order_by('id').iterator():
+        ingredients[recipe_id].append(name)
+    RecipeSearchIndex.objects.bulk_create(
+        (
+            RecipeSearchIndex(
+                recipe_id=recipe_id,
+                name=name,
+                body='\n'.join([text, *ingredients[recipe_id]]),
+            )
+            for recipe_id, name, text in Recipe.objects.values_list(
+                'id', 'name', 'text').iterator()
+        ),
+        batch_size=1000,
+    )
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute(
+            "UPDATE recipes_recipesearchindex SET vector = "
+            "setweight(to_tsvector('russian', name), 'A') || "
+            "setweight(to_tsvector('russian', body), 'B')"
+        )
+    elif vendor == 'sqlite':
+        schema_editor.execute(
+            f'INSERT INTO {FTS_TABLE} (rowid, name, body) '
+            'SELECT recipe_id, name, body FROM recipes_recipesearchindex'
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0007_shoppinglistitem'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecipeSearchIndex',
+            fields=[
+                ('recipe', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='search_index', serialize=False, to='recipes.recipe', verbose_name='рецепт')),
+                ('name', models.TextField(verbose_name='название')),
+                ('body', models.TextField(verbose_name='описание и ингредиенты')),
+                ('vector', django.contrib.postgres.search.SearchVectorField(null=True)),
+            ],
+            options={
+                'verbose_name': 'Поисковый документ рецепта',
+                'verbose_name_plural': 'Поисковые документы рецептов',
+            },
+        ),
+        migrations.RunPython(create_search_backend, drop_search_backend),
+        migrations.RunPython(fill_search_index, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,89 @@
+# Generated by Django 5.0.6 on 2026-10-18 20:33
+
+from itertools import islice
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, F, Window
+from django.db.models.functions import RowNumber
+
+FANOUT_MAX_FOLLOWERS = 1000
+BACKFILL_SIZE = 100
+BULK_BATCH_SIZE = 1000
+
+
+def fill_timelines(apps, schema_editor):
+    Follow = apps.get_model('users', 'Follow')
+    Recipe = apps.get_model('recipes', 'Recipe')
+    TimelineEntry = apps.get_model('recipes', 'TimelineEntry')
+    PopularAuthor = apps.get_model('recipes', 'PopularAuthor')
+    popular = set(
+        Follow.objects.values('following_id').annotate(
+            followers=Count('id')
+        ).filter(followers__gt=FANOUT_MAX_FOLLOWERS).values_list(
+            'following_id', flat=True)
+    )
+    PopularAuthor.objects.bulk_create(
+        PopularAuthor(author_id=author_id) for author_id in popular)
+    recipes = {}
+    for recipe_id, author_id, pub_date in Recipe.objects.exclude(
+        author_id__in=popular
+    ).annotate(row_number=Window(
+        RowNumber(), partition_by=F('author_id'),
+        order_by=(F('pub_date').desc(), F('id').desc()),
+    )).filter(row_number__lte=BACKFILL_SIZE).values_list(
+        'id', 'author_id', 'pub_date'
+    ).iterator():
+        recipes.setdefault(author_id, []).append((recipe_id, pub_date))
+    entries = (
+        TimelineEntry(user_id=follower_id, recipe_id=recipe_id,
+                      author_id=author_id, pub_date=pub_date)
+        for follower_id, author_id in Follow.objects.values_list(
+            'follower_id', 'following_id').order_by().iterator()
+        for recipe_id, pub_date in recipes.get(author_id, ())
+    )
+    while batch := list(islice(entries, BULK_BATCH_SIZE)):
+        TimelineEntry.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0008_recipesearchindex'),
+        ('users', '0007_alter_follow_options_alter_user_username'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PopularAuthor',
+            fields=[
+                ('author', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='popular_author', serialize=False, to=settings.AUTH_USER_MODEL, verbose_name='автор')),
+            ],
+            options={
+                'verbose_name': 'Популярный автор',
+                'verbose_name_plural': 'Популярные авторы',
+            },
+        ),
+        migrations.CreateModel(
+            name='TimelineEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('pub_date', models.DateTimeField(verbose_name='дата публикации')),
+                ('author', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='автор')),
+                ('recipe', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timeline_entries', to='recipes.recipe', verbose_name='рецепт')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timeline', to=settings.AUTH_USER_MODEL, verbose_name='читатель ленты')),
+            ],
+            options={
+                'verbose_name': 'Запись ленты',
+                'verbose_name_plural': 'Записи ленты',
+                'indexes': [models.Index(fields=['user', '-pub_date', '-recipe'], name='timeline_user_pub_date')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='timelineentry',
+            constraint=models.UniqueConstraint(fields=('user', 'recipe'), name='timeline_entry'),
+        ),
+        migrations.RunPython(fill_timelines, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.0.6 on 2026-10-18 21:04
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def copy_stale_flags(apps, schema_editor):
+    RecipeSearchIndex = apps.get_model('recipes', 'RecipeSearchIndex')
+    StaleSimilarRecipe = apps.get_model('recipes', 'StaleSimilarRecipe')
+    StaleSimilarRecipe.objects.bulk_create(
+        StaleSimilarRecipe(recipe_id=recipe_id)
+        for recipe_id in RecipeSearchIndex.objects.filter(
+            similar_stale=True).values_list('recipe_id', flat=True).iterator()
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0011_lookup_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StaleSimilarRecipe',
+            fields=[
+                ('recipe', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='similar_stale', serialize=False, to='recipes.recipe', verbose_name='рецепт')),
+            ],
+            options={
+                'verbose_name': 'Рецепт с устаревшими похожими',
+                'verbose_name_plural': 'Рецепты с устаревшими похожими',
+            },
+        ),
+        migrations.RunPython(copy_stale_flags, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name='recipesearchindex',
+            name='search_similar_stale',
+        ),
+        migrations.RemoveField(
+            model_name='recipesearchindex',
+            name='similar_stale',
+        ),
+    ]
@@ -1,10 +1,13 @@
 from colorfield.fields import ColorField
+from django.contrib.postgres.search import SearchVectorField
 from django.core.validators import MinValueValidator
-from django.db import models
+from django.db import connection, models, transaction
+from django.db.models import (BooleanField, Case, Exists, F, OuterRef,
+                              Prefetch, Sum, Value, When)
 
 from recipes.constants import (MAX_COLOR_FIELD_LENGTH, MAX_FILED_LENGTH,
                                MAX_TEXT_LENGTH, MIN_COOKING_TIME)
-from users.models import User
+from users.models import Follow, User
 
 
 class Tag(models.Model):
@@ -43,13 +46,70 @@ class Ingredient(models.Model):
         return self.name[:MAX_TEXT_LENGTH]
 
 
+class RecipeQuerySet(models.QuerySet):
+    """Загрузка рецептов под поля ответа RecipeReadSerializer.
+
+    fields - поля ответа из ?fields= и ?omit=, None - все поля. Для
+    отброшенных полей не выполняются prefetch, подзапросы и не читаются
+    колонки.
+    """
+
+    def with_related(self, fields=None):
+        lookups = []
+        if fields is None or "tags" in fields:
+            lookups.append("tags")
+        if fields is None or "ingredients" in fields:
+            lookups.append(Prefetch(
+                "recipe_ingredients",
+                queryset=RecipeIngredient.objects.select_related(
+                    "ingredient").order_by("id"),
+            ))
+        queryset = self.prefetch_related(*lookups)
+        if fields is None:
+            return queryset
+        return queryset.defer(*(
+            name for name in ("name", "image", "text", "cooking_time")
+            if name not in fields
+        ))
+
+    def with_user_flags(self, user, fields=None):
+        flags = {
+            "is_favorited": Favorite, "is_in_shopping_cart": ShoppingCart,
+        }
+        if fields is not None:
+            flags = {
+                name: model for name, model in flags.items()
+                if name in fields
+            }
+        author = fields is None or "author" in fields
+        if not user.is_authenticated:
+            queryset = self.select_related("author") if author else self
+            return queryset.annotate(**dict.fromkeys(
+                flags, Value(False, output_field=BooleanField())))
+        queryset = self
+        if author:
+            queryset = queryset.prefetch_related(Prefetch(
+                "author", queryset=User.objects.annotate(is_subscribed=Exists(
+                    Follow.objects.filter(
+                        follower=user, following=OuterRef("pk"))
+                )),
+            ))
+        return queryset.annotate(**{
+            name: Exists(model.objects.filter(
+                user=user, recipe=OuterRef("pk")))
+            for name, model in flags.items()
+        })
+
+
 class Recipe(models.Model):
     ingredients = models.ManyToManyField(
         Ingredient, through="RecipeIngredient", related_name="recipes"
     )
     tags = models.ManyToManyField(Tag, related_name="recipes")
     author = models.ForeignKey(
-        User, on_delete=models.CASCADE, related_name="recipes")
+        User, on_delete=models.CASCADE, related_name="recipes",
+        db_index=False,
+    )
     image = models.ImageField(upload_to="images", blank=True)
     name = models.CharField(
         "название", unique=True,
@@ -66,10 +126,16 @@ class Recipe(models.Model):
         "дата публикации", auto_now_add=True, db_index=True
     )
 
+    objects = RecipeQuerySet.as_manager()
+
     class Meta:
         ordering = ("-pub_date",)
         verbose_name = "Рецепт"
         verbose_name_plural = "Рецепты"
+        indexes = [
+            models.Index(fields=("author", "-pub_date", "-id"),
+                         name="recipe_author_pub_date"),
+        ]
 
     def __str__(self):
         return self.name[:MAX_TEXT_LENGTH]
@@ -118,19 +184,76 @@ class RecipeIngredient(models.Model):
         return self.ingredient.name[:MAX_TEXT_LENGTH]
 
 
+class UserRecipeQuerySet(models.QuerySet):
+    """Добавление и удаление рецептов пользователя одним запросом.
+
+    Вставка с ON CONFLICT DO NOTHING и удаление возвращают id изменённых
+    рецептов через RETURNING, повторное добавление и удаление ничего не
+    меняют. Сигналы post_save и pre_delete не отправляются.
+    """
+
+    def returning_ids(self, sql, user_id, recipe_ids):
+        recipe_ids = list(dict.fromkeys(recipe_ids))
+        if not recipe_ids:
+            return []
+        placeholders = ", ".join(["%s"] * len(recipe_ids))
+        with connection.cursor() as cursor:
+            cursor.execute(sql.format(
+                table=connection.ops.quote_name(self.model._meta.db_table),
+                recipes=connection.ops.quote_name(Recipe._meta.db_table),
+                ids=placeholders,
+            ), [user_id, *recipe_ids])
+            return [recipe_id for recipe_id, in cursor.fetchall()]
+
+    def add(self, user_id, recipe_ids):
+        """Добавляет существующие рецепты, которых ещё нет у пользователя."""
+        return self.returning_ids(
+            "INSERT INTO {table} (user_id, recipe_id) "
+            "SELECT %s, id FROM {recipes} WHERE id IN ({ids}) "
+            "ON CONFLICT DO NOTHING RETURNING recipe_id",
+            user_id, recipe_ids,
+        )
+
+    def remove(self, user_id, recipe_ids):
+        return self.returning_ids(
+            "DELETE FROM {table} WHERE user_id = %s AND recipe_id IN ({ids}) "
+            "RETURNING recipe_id",
+            user_id, recipe_ids,
+        )
+
+
+class ShoppingCartQuerySet(UserRecipeQuerySet):
+    """Корзина, которая вместо сигналов сама обновляет список покупок."""
+
+    def add(self, user_id, recipe_ids):
+        with transaction.atomic():
+            added = super().add(user_id, recipe_ids)
+            ShoppingListItem.objects.add_recipes([user_id], added)
+        return added
+
+    def remove(self, user_id, recipe_ids):
+        with transaction.atomic():
+            removed = super().remove(user_id, recipe_ids)
+            ShoppingListItem.objects.add_recipes([user_id], removed, sign=-1)
+        return removed
+
+
 class Favorite(models.Model):
     recipe = models.ForeignKey(
         Recipe, on_delete=models.CASCADE, related_name="favorites"
     )
     user = models.ForeignKey(
-        User, on_delete=models.CASCADE, related_name="favorites"
+        User, on_delete=models.CASCADE, related_name="favorites",
+        db_index=False,
     )
 
+    objects = UserRecipeQuerySet.as_manager()
+
     class Meta:
-        ordering = ("recipe", "user")
+        ordering = ("user_id", "recipe_id")
         verbose_name = "Избранное"
         constraints = [
-            models.UniqueConstraint(fields=["recipe", "user"], name="favorite")
+            models.UniqueConstraint(fields=["user", "recipe"], name="favorite")
         ]
 
     def __str__(self) -> str:
@@ -149,15 +272,250 @@ class ShoppingCart(models.Model):
         on_delete=models.CASCADE,
         verbose_name="владелец корзины",
         related_name="shopping_carts",
+        db_index=False,
     )
 
+    objects = ShoppingCartQuerySet.as_manager()
+
     class Meta:
         verbose_name = "Список покупок"
         constraints = [
             models.UniqueConstraint(
-                fields=("recipe", "user"), name="recipe_is_in_cart")
+                fields=("user", "recipe"), name="recipe_is_in_cart")
         ]
-        ordering = ('user__username',)
+        ordering = ("user_id", "recipe_id")
 
     def __str__(self):
         return f"{self.recipe} находится в корзине у {self.user}"
+
+
+class ShoppingListQuerySet(models.QuerySet):
+
+    def apply(self, user_ids, amounts):
+        """Прибавляет к спискам покупок количества {ингредиент: число}.
+
+        Отрицательные количества вычитаются, позиции с нулём и меньше
+        удаляются.
+        """
+        user_ids = list(user_ids)
+        amounts = {
+            ingredient: amount
+            for ingredient, amount in amounts.items() if amount
+        }
+        if not user_ids or not amounts:
+            return
+        # Сначала вставляются недостающие позиции с нулём: параллельная
+        # вставка той же позиции пропускается, а не падает на уникальном
+        # ограничении. Затем UPDATE блокирует строки и прибавляет суммы.
+        with transaction.atomic():
+            self.bulk_create(
+                (self.model(user_id=user_id, ingredient_id=ingredient,
+                            amount=0)
+                 for user_id in user_ids
+                 for ingredient, amount in amounts.items() if amount > 0),
+                ignore_conflicts=True,
+            )
+            items = self.filter(
+                user_id__in=user_ids, ingredient_id__in=amounts)
+            items.update(amount=F("amount") + Case(
+                *(When(ingredient_id=ingredient, then=Value(amount))
+                  for ingredient, amount in amounts.items()),
+                default=Value(0),
+            ))
+            if min(amounts.values()) < 0:
+                items.filter(amount__lte=0).delete()
+
+    def add_recipes(self, user_ids, recipe_ids, sign=1):
+        self.apply(user_ids, {
+            ingredient: sign * amount
+            for ingredient, amount in RecipeIngredient.objects.filter(
+                recipe_id__in=recipe_ids
+            ).values("ingredient_id").annotate(
+                total=Sum("amount")).values_list("ingredient_id", "total")
+        })
+
+
+class ShoppingListItem(models.Model):
+    """Сумма ингредиентов из корзины пользователя.
+
+    Обновляется при изменении корзины и состава рецептов, пересобирается
+    командой rebuild_shopping_lists.
+    """
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        verbose_name="владелец списка",
+        related_name="shopping_list",
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        verbose_name="ингредиент",
+        related_name="shopping_list",
+    )
+    amount = models.BigIntegerField(verbose_name="количество")
+
+    objects = ShoppingListQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = "Позиция списка покупок"
+        verbose_name_plural = "Позиции списка покупок"
+        constraints = [
+            models.UniqueConstraint(
+                fields=("user", "ingredient"), name="shopping_list_item")
+        ]
+
+    def __str__(self):
+        return f"{self.ingredient} - {self.amount}"
+
+
+class RecipeSearchIndex(models.Model):
+    """Документ полнотекстового поиска по рецепту.
+
+    Название и текст рецепта вместе с названиями ингредиентов. На Postgres
+    поиск идёт по полю vector с GIN-индексом, на SQLite - по таблице FTS5.
+    Индекс и таблица FTS5 создаются миграцией 0008 только на своей базе.
+    Документы обновляются функцией recipes.search.index_recipes и
+    пересобираются командой rebuild_search_index.
+    """
+
+    recipe = models.OneToOneField(
+        Recipe,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="search_index",
+        verbose_name="рецепт",
+    )
+    name = models.TextField("название")
+    body = models.TextField("описание и ингредиенты")
+    vector = SearchVectorField(null=True)
+
+    class Meta:
+        verbose_name = "Поисковый документ рецепта"
+        verbose_name_plural = "Поисковые документы рецептов"
+
+    def __str__(self):
+        return self.name[:MAX_TEXT_LENGTH]
+
+
+class TimelineEntry(models.Model):
+    """Рецепт в ленте подписчика, записанный при публикации.
+
+    Лента пользователя читается одним проходом по индексу
+    (user, -pub_date, -recipe) без соединения рецептов с подписками.
+    """
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        verbose_name="читатель ленты",
+        related_name="timeline",
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        verbose_name="рецепт",
+        related_name="timeline_entries",
+    )
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        verbose_name="автор",
+        related_name="+",
+    )
+    pub_date = models.DateTimeField("дата публикации")
+
+    class Meta:
+        verbose_name = "Запись ленты"
+        verbose_name_plural = "Записи ленты"
+        constraints = [
+            models.UniqueConstraint(
+                fields=("user", "recipe"), name="timeline_entry")
+        ]
+        indexes = [
+            models.Index(fields=("user", "-pub_date", "-recipe"),
+                         name="timeline_user_pub_date"),
+        ]
+
+    def __str__(self):
+        return f"{self.user}: {self.recipe}"
+
+
+class PopularAuthor(models.Model):
+    """Автор, рецепты которого не раскладываются по лентам подписчиков.
+
+    У таких авторов подписчиков больше FEED_FANOUT_MAX_FOLLOWERS, и их
+    рецепты добавляются к ленте при чтении.
+    """
+
+    author = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        verbose_name="автор",
+        related_name="popular_author",
+    )
+
+    class Meta:
+        verbose_name = "Популярный автор"
+        verbose_name_plural = "Популярные авторы"
+
+    def __str__(self):
+        return str(self.author)
+
+
+class SimilarRecipe(models.Model):
+    """Рецепт из списка похожих, посчитанного compute_similar_recipes."""
+
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        verbose_name="рецепт",
+        related_name="similar",
+    )
+    similar = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        verbose_name="похожий рецепт",
+        related_name="similar_to",
+    )
+    score = models.FloatField("сходство")
+
+    class Meta:
+        verbose_name = "Похожий рецепт"
+        verbose_name_plural = "Похожие рецепты"
+        constraints = [
+            models.UniqueConstraint(
+                fields=("recipe", "similar"), name="similar_recipe")
+        ]
+        indexes = [
+            models.Index(fields=("recipe", "-score"),
+                         name="similar_recipe_score"),
+        ]
+
+    def __str__(self):
+        return f"{self.recipe} ~ {self.similar}"
+
+
+class StaleSimilarRecipe(models.Model):
+    """Рецепт, похожие рецепты которого нужно пересчитать.
+
+    Отмечается функцией recipes.similarity.mark_stale при изменении
+    состава или тегов рецепта, очередь разбирает compute_similar_recipes.
+    """
+
+    recipe = models.OneToOneField(
+        Recipe,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="similar_stale",
+        verbose_name="рецепт",
+    )
+
+    class Meta:
+        verbose_name = "Рецепт с устаревшими похожими"
+        verbose_name_plural = "Рецепты с устаревшими похожими"
+
+    def __str__(self):
+        return str(self.recipe_id)
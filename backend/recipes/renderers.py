@@ -0,0 +1,47 @@
+import orjson
+from rest_framework.renderers import JSONRenderer
+
+
+class FastJSONRenderer(JSONRenderer):
+    """JSONRenderer на orjson с тем же выводом байт в байт.
+
+    Даты, Decimal и ленивые строки orjson передаёт в default кодировщика
+    DRF, поэтому их формат не меняется. Вывод с отступами (для
+    BrowsableAPIRenderer и ?indent=) и значения, которые orjson не умеет
+    кодировать, рендерит обычный JSONRenderer.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if (
+            data is None or self.ensure_ascii or not self.compact
+            or self.get_indent(accepted_media_type, renderer_context or {})
+            is not None
+        ):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = orjson.dumps(
+                data,
+                default=self.encoder_class().default,
+                option=(orjson.OPT_PASSTHROUGH_DATETIME
+                        | orjson.OPT_PASSTHROUGH_DATACLASS),
+            )
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        return ret.replace("\u2028".encode(), b"\\u2028").replace(
+            "\u2029".encode(), b"\\u2029")
+
+
+class ShoppingCartTextRenderer(JSONRenderer):
+    """Выбирает формат txt для ?format= и заголовка Accept.
+
+    Сам список покупок отдаётся потоком из download_shopping_cart, через
+    рендерер проходят только ответы с ошибками, они остаются в JSON.
+    """
+
+    media_type = "text/plain"
+    format = "txt"
+
+
+class ShoppingCartCSVRenderer(ShoppingCartTextRenderer):
+    media_type = "text/csv"
+    format = "csv"
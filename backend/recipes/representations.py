@@ -0,0 +1,131 @@
+from collections import defaultdict
+from operator import attrgetter
+
+from django.db.models import Exists, OuterRef
+from rest_framework.response import Response
+
+from recipes.models import Recipe, RecipeIngredient
+from recipes.serializers import RecipeReadSerializer
+from users.models import Follow
+
+COLUMNS = ("name", "image", "text", "cooking_time")
+AUTHOR_COLUMNS = (
+    "author__id", "author__email", "author__username", "author__first_name",
+    "author__last_name",
+)
+
+
+def list_queryset(queryset, user, fields=None):
+    """Queryset рецептов с автором в том же запросе и без prefetch.
+
+    Читаются только колонки полей fields (None - все поля). Подписка на
+    автора считается подзапросом, поэтому страница читается одним
+    запросом вместе с флагами из with_user_flags.
+    """
+    if fields is None:
+        fields = RecipeReadSerializer.Meta.fields
+    queryset = queryset.prefetch_related(None).select_related(None)
+    columns = ["id", "pub_date"]
+    columns += [name for name in COLUMNS if name in fields]
+    if "author" in fields:
+        queryset = queryset.select_related("author")
+        columns += AUTHOR_COLUMNS
+        if user.is_authenticated:
+            queryset = queryset.annotate(author_is_subscribed=Exists(
+                Follow.objects.filter(
+                    follower=user, following=OuterRef("author"))
+            ))
+    return queryset.only(*columns)
+
+
+def recipe_list_data(recipes, request, fields=None):
+    """Представления рецептов в формате RecipeReadSerializer.
+
+    Рецепты берутся из list_queryset с теми же fields. Теги и
+    ингредиенты читаются через values_list по id рецептов страницы, по
+    запросу на каждую нужную связь, и собираются в словари в порядке
+    полей сериализатора.
+    """
+    if fields is None:
+        fields = RecipeReadSerializer.Meta.fields
+    ids = [recipe.id for recipe in recipes]
+    tags = defaultdict(list)
+    if "tags" in fields:
+        for recipe_id, pk, name, color, slug in (
+            Recipe.tags.through.objects.filter(recipe_id__in=ids)
+            .values_list("recipe_id", "tag__id", "tag__name", "tag__color",
+                         "tag__slug")
+            .order_by("tag__name")
+        ):
+            tags[recipe_id].append(
+                {"id": pk, "name": name, "color": color, "slug": slug})
+    ingredients = defaultdict(list)
+    if "ingredients" in fields:
+        for recipe_id, pk, name, unit, amount in (
+            RecipeIngredient.objects.filter(recipe_id__in=ids)
+            .values_list("recipe_id", "id", "ingredient__name",
+                         "ingredient__measurement_unit", "amount")
+            .order_by("id")
+        ):
+            ingredients[recipe_id].append({
+                "id": pk, "name": name, "measurement_unit": unit,
+                "amount": amount,
+            })
+    authors = {}
+
+    def author(recipe):
+        if recipe.author_id not in authors:
+            user = recipe.author
+            authors[user.id] = {
+                "id": user.id,
+                "email": user.email,
+                "username": user.username,
+                "first_name": user.first_name,
+                "last_name": user.last_name,
+                "is_subscribed": getattr(
+                    recipe, "author_is_subscribed", False),
+            }
+        return authors[recipe.author_id]
+
+    def image(recipe):
+        if not recipe.image:
+            return None
+        return request.build_absolute_uri(recipe.image.url)
+
+    getters = {
+        "id": attrgetter("id"),
+        "tags": lambda recipe: tags[recipe.id],
+        "author": author,
+        "ingredients": lambda recipe: ingredients[recipe.id],
+        "is_favorited": attrgetter("is_favorited"),
+        "is_in_shopping_cart": attrgetter("is_in_shopping_cart"),
+        "name": attrgetter("name"),
+        "image": image,
+        "text": attrgetter("text"),
+        "cooking_time": attrgetter("cooking_time"),
+    }
+    getters = [(name, getters[name]) for name in fields]
+    return [
+        {name: getter(recipe) for name, getter in getters}
+        for recipe in recipes
+    ]
+
+
+class FastRecipeListMixin:
+    """Отдаёт список рецептов без сериализаторов DRF.
+
+    Страница выбирается тем же пагинатором по queryset из list_queryset,
+    а представления строит recipe_list_data. Формат ответа совпадает с
+    RecipeReadSerializer, это проверяет RecipeRepresentationTests.
+    Поля ответа задаёт requested_fields view.
+    """
+
+    def list(self, request, *args, **kwargs):
+        fields = self.requested_fields()
+        queryset = list_queryset(
+            self.filter_queryset(self.get_queryset()), request.user, fields)
+        page = self.paginate_queryset(queryset)
+        if page is None:
+            return Response(recipe_list_data(list(queryset), request, fields))
+        return self.get_paginated_response(
+            recipe_list_data(page, request, fields))
@@ -0,0 +1,318 @@
+import itertools
+import re
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter, defaultdict
+
+from django.contrib.postgres.search import (SearchQuery, SearchRank,
+                                            SearchVector)
+from django.db import connection
+from django.db.models import Count, F, FloatField, Q
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Cast
+
+from recipes.cache import get_changes, get_version
+from recipes.constants import (PANTRY_INDEX_MAX_DELTA, PANTRY_INDEX_MIN_AGE,
+                               SEARCH_CONFIG, SEARCH_INDEX_BATCH_SIZE)
+from recipes.models import (Ingredient, Recipe, RecipeIngredient,
+                            RecipeSearchIndex)
+
+FTS_TABLE = "recipes_recipesearch_fts"
+
+
+class IngredientIndex:
+    """Индекс названий ингредиентов в памяти процесса.
+
+    Названия хранятся отсортированными в нижнем регистре: совпадения по
+    началу названия находятся двоичным поиском, совпадения по подстроке -
+    поиском по одной строке со всеми названиями. Индекс строится при
+    первом обращении и перестраивается, когда меняется версия
+    ингредиентов в кэше.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = None
+        self.state = ([], [], "", [])
+
+    def build(self, version):
+        rows = sorted(
+            Ingredient.objects.values("id", "name", "measurement_unit"),
+            key=lambda row: (row["name"].lower(), row["id"]),
+        )
+        keys = [row["name"].lower() for row in rows]
+        offsets = []
+        position = 0
+        for key in keys:
+            offsets.append(position)
+            position += len(key) + 1
+        self.state = (keys, rows, "\n".join(keys), offsets)
+        self.version = version
+
+    def ensure_fresh(self):
+        version = get_version("ingredients")
+        if self.version != version:
+            with self.lock:
+                if self.version != version:
+                    self.build(version)
+
+    def search(self, query, limit):
+        """Сначала совпадения по началу названия, затем по подстроке."""
+        self.ensure_fresh()
+        keys, rows, text, offsets = self.state
+        query = query.lower().replace("\n", " ")
+        start = bisect_left(keys, query)
+        stop = bisect_left(keys, query + "\U0010ffff", start)
+        result = rows[start:min(stop, start + limit)]
+        position = text.find(query)
+        while position != -1 and len(result) < limit:
+            number = bisect_right(offsets, position) - 1
+            if not start <= number < stop:
+                result.append(rows[number])
+            if number + 1 == len(offsets):
+                break
+            position = text.find(query, offsets[number + 1])
+        return result
+
+
+ingredient_index = IngredientIndex()
+
+
+def contains(postings, recipe_id):
+    position = bisect_left(postings, recipe_id)
+    return position < len(postings) and postings[position] == recipe_id
+
+
+class PantryIndex:
+    """Обратный индекс ингредиент -> рецепты в памяти процесса.
+
+    Для каждого ингредиента хранится отсортированный массив id рецептов,
+    для каждого рецепта - число ингредиентов в нём. Изменения составов
+    рецептов записываются в журнал log_changes версии
+    recipe_ingredients, и индекс перечитывает из базы только изменённые
+    рецепты. Если журнал потерян или изменений слишком много, индекс
+    пересобирается в фоновом потоке не чаще раза в PANTRY_INDEX_MIN_AGE
+    секунд, а запросы до этого обслуживает прежнее состояние. Пока
+    индекс ещё не построен, рецепты подбираются запросом к базе.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = None
+        self.built_at = 0.0
+        self.state = None
+
+    def build(self, version):
+        postings = defaultdict(lambda: array("q"))
+        sizes = Counter()
+        for ingredient_id, recipe_id in RecipeIngredient.objects.values_list(
+            "ingredient_id", "recipe_id"
+        ).order_by("ingredient_id", "recipe_id").iterator():
+            postings[ingredient_id].append(recipe_id)
+            sizes[recipe_id] += 1
+        self.state = (dict(postings), sizes)
+        self.version = version
+        self.built_at = time.monotonic()
+
+    def build_in_background(self):
+        if not self.lock.acquire(blocking=False):
+            return
+
+        def run():
+            try:
+                self.build(get_version("recipe_ingredients"))
+            finally:
+                connection.close()
+                self.lock.release()
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def apply(self, recipe_ids, version):
+        """Перечитывает составы рецептов recipe_ids.
+
+        Изменённые массивы копируются, а не правятся на месте, чтобы
+        параллельный поиск видел целый массив.
+        """
+        current = defaultdict(set)
+        sizes = Counter()
+        for recipe_id, ingredient_id in RecipeIngredient.objects.filter(
+            recipe_id__in=recipe_ids
+        ).values_list("recipe_id", "ingredient_id"):
+            current[ingredient_id].add(recipe_id)
+            sizes[recipe_id] += 1
+        postings, recipe_sizes = self.state
+        for ingredient_id in postings.keys() | current.keys():
+            old = postings.get(ingredient_id, array("q"))
+            indexed = {
+                recipe_id for recipe_id in recipe_ids
+                if contains(old, recipe_id)
+            }
+            wanted = current.get(ingredient_id, set())
+            if indexed == wanted:
+                continue
+            updated = array("q", old)
+            for recipe_id in indexed - wanted:
+                del updated[bisect_left(updated, recipe_id)]
+            for recipe_id in wanted - indexed:
+                updated.insert(bisect_left(updated, recipe_id), recipe_id)
+            postings[ingredient_id] = updated
+        for recipe_id in recipe_ids:
+            if sizes[recipe_id]:
+                recipe_sizes[recipe_id] = sizes[recipe_id]
+            else:
+                recipe_sizes.pop(recipe_id, None)
+        self.version = version
+
+    def ensure_fresh(self):
+        """Догоняет версию recipe_ingredients; False, если индекса нет."""
+        if self.state is None:
+            self.build_in_background()
+            return False
+        version = get_version("recipe_ingredients")
+        if self.version == version:
+            return True
+        changes = None
+        if 0 <= version - self.version <= PANTRY_INDEX_MAX_DELTA:
+            changes = get_changes(
+                "recipe_ingredients", self.version, version)
+        if changes is None or len(changes) > PANTRY_INDEX_MAX_DELTA:
+            if time.monotonic() - self.built_at >= PANTRY_INDEX_MIN_AGE:
+                self.build_in_background()
+        elif self.lock.acquire(blocking=False):
+            try:
+                self.apply(changes, version)
+            finally:
+                self.lock.release()
+        return True
+
+    def search(self, ingredient_ids, max_missing=None):
+        """id рецептов, лучше всего покрытых ингредиентами пользователя.
+
+        Сначала рецепты с большей долей имеющихся ингредиентов, при
+        равенстве - с меньшим числом недостающих, затем новые.
+        """
+        if not self.ensure_fresh():
+            return search_pantry(ingredient_ids, max_missing)
+        postings, sizes = self.state
+        covered = Counter()
+        for ingredient_id in set(ingredient_ids):
+            covered.update(postings.get(ingredient_id, ()))
+        found = []
+        for recipe_id, count in covered.items():
+            size = sizes.get(recipe_id)
+            # Рецепт мог быть удалён, пока читался прежний массив.
+            if not size:
+                continue
+            if max_missing is None or size - count <= max_missing:
+                found.append((count / size, size - count, recipe_id))
+        found.sort(key=lambda row: (-row[0], row[1], -row[2]))
+        return [recipe_id for _, _, recipe_id in found]
+
+
+def search_pantry(ingredient_ids, max_missing=None):
+    """То же, что PantryIndex.search, одним запросом к базе."""
+    recipes = Recipe.objects.filter(
+        id__in=RecipeIngredient.objects.filter(
+            ingredient_id__in=ingredient_ids).values("recipe_id")
+    ).annotate(
+        size=Count("recipe_ingredients"),
+        covered=Count("recipe_ingredients", filter=Q(
+            recipe_ingredients__ingredient_id__in=ingredient_ids)),
+    ).annotate(
+        share=Cast("covered", FloatField()) / F("size"),
+        missing=F("size") - F("covered"),
+    )
+    if max_missing is not None:
+        recipes = recipes.filter(missing__lte=max_missing)
+    return list(recipes.order_by("-share", "missing", "-id").values_list(
+        "id", flat=True))
+
+
+pantry_index = PantryIndex()
+
+
+def index_recipes(recipe_ids):
+    """Пересчитывает поисковые документы рецептов пачками.
+
+    Документы удалённых рецептов убираются из таблицы FTS5.
+    """
+    recipe_ids = iter(recipe_ids)
+    while batch := list(itertools.islice(recipe_ids,
+                                         SEARCH_INDEX_BATCH_SIZE)):
+        index_batch(batch)
+
+
+def index_batch(recipe_ids):
+    ingredients = defaultdict(list)
+    for recipe_id, name in RecipeIngredient.objects.filter(
+        recipe_id__in=recipe_ids
+    ).values_list("recipe_id", "ingredient__name").order_by("id"):
+        ingredients[recipe_id].append(name)
+    RecipeSearchIndex.objects.bulk_create(
+        [
+            RecipeSearchIndex(
+                recipe_id=recipe_id,
+                name=name,
+                body="\n".join([text, *ingredients[recipe_id]]),
+            )
+            for recipe_id, name, text in Recipe.objects.filter(
+                id__in=recipe_ids).values_list("id", "name", "text")
+        ],
+        update_conflicts=True,
+        unique_fields=["recipe"],
+        update_fields=["name", "body"],
+    )
+    if connection.vendor == "postgresql":
+        RecipeSearchIndex.objects.filter(recipe_id__in=recipe_ids).update(
+            vector=SearchVector("name", weight="A", config=SEARCH_CONFIG)
+            + SearchVector("body", weight="B", config=SEARCH_CONFIG)
+        )
+    elif connection.vendor == "sqlite":
+        placeholders = ", ".join(["%s"] * len(recipe_ids))
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"DELETE FROM {FTS_TABLE} WHERE rowid IN ({placeholders})",
+                recipe_ids,
+            )
+            cursor.execute(
+                f"INSERT INTO {FTS_TABLE} (rowid, name, body) "
+                f"SELECT recipe_id, name, body "
+                f"FROM {RecipeSearchIndex._meta.db_table} "
+                f"WHERE recipe_id IN ({placeholders})",
+                recipe_ids,
+            )
+
+
+def search_recipes(queryset, query):
+    """Оставляет рецепты, подходящие под запрос, по убыванию релевантности.
+
+    Совпадение в названии весит больше, чем в описании и ингредиентах.
+    """
+    if connection.vendor == "postgresql":
+        search_query = SearchQuery(
+            query, config=SEARCH_CONFIG, search_type="websearch")
+        return queryset.filter(
+            search_index__vector=search_query
+        ).annotate(
+            search_rank=SearchRank(F("search_index__vector"), search_query)
+        ).order_by("-search_rank", "-pub_date")
+    words = re.findall(r"\w+", query)
+    if not words:
+        return queryset.none()
+    if connection.vendor == "sqlite":
+        rank = RawSQL(
+            f"SELECT bm25({FTS_TABLE}, 10.0, 1.0) FROM {FTS_TABLE} "
+            f"WHERE {FTS_TABLE} MATCH %s "
+            f"AND rowid = {Recipe._meta.db_table}.id",
+            (" ".join(f'"{word}"*' for word in words),),
+        )
+        return queryset.annotate(search_rank=rank).filter(
+            search_rank__isnull=False).order_by("search_rank", "-pub_date")
+    for word in words:
+        queryset = queryset.filter(
+            Q(search_index__name__icontains=word)
+            | Q(search_index__body__icontains=word)
+        )
+    return queryset
@@ -1,11 +1,77 @@
-from djoser.serializers import UserSerializer
+from urllib.parse import urlsplit
+
+from django.db import transaction
+from django.urls import reverse
 from drf_base64.fields import Base64ImageField
 from rest_framework import serializers
-
-from recipes.constants import MIN_AMOUNT
-from recipes.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
-                            ShoppingCart, Tag)
-from users.serializers import FollowRecipeSerializer
+from rest_framework.relations import MANY_RELATION_KWARGS, ManyRelatedField
+
+from recipes.cache import invalidate_recipe, log_changes, per_request
+from recipes.constants import (API_BATCH_MAX_REQUESTS, MIN_AMOUNT,
+                               PANTRY_MAX_INGREDIENTS, RECIPES_BATCH_MAX_SIZE)
+from recipes.models import (Ingredient, Recipe, RecipeIngredient,
+                            ShoppingCart, ShoppingListItem, Tag)
+from recipes.search import index_recipes
+from recipes.similarity import mark_stale
+from users.serializers import (FollowRecipeSerializer, SparseFieldsetMixin,
+                               UserSerializer)
+
+
+class BulkPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """PrimaryKeyRelatedField, который ищет объекты в загруженном словаре.
+
+    Вызов prefetch загружает все переданные ключи одним запросом IN,
+    сообщения об ошибках остаются такими же, как у PrimaryKeyRelatedField.
+    """
+
+    prefetched = None
+
+    @classmethod
+    def many_init(cls, *args, **kwargs):
+        list_kwargs = {"child_relation": cls(*args, **kwargs)}
+        for key in kwargs:
+            if key in MANY_RELATION_KWARGS:
+                list_kwargs[key] = kwargs[key]
+        return BulkManyRelatedField(**list_kwargs)
+
+    def prefetch(self, values):
+        pks = set()
+        for value in values:
+            try:
+                if not isinstance(value, bool):
+                    pks.add(int(value))
+            except (TypeError, ValueError):
+                continue
+        self.prefetched = self.get_queryset().in_bulk(pks)
+
+    def to_internal_value(self, data):
+        if self.prefetched is None:
+            return super().to_internal_value(data)
+        if isinstance(data, bool):
+            self.fail("incorrect_type", data_type=type(data).__name__)
+        try:
+            return self.prefetched[int(data)]
+        except (TypeError, ValueError):
+            self.fail("incorrect_type", data_type=type(data).__name__)
+        except KeyError:
+            self.fail("does_not_exist", pk_value=data)
+
+
+class BulkManyRelatedField(ManyRelatedField):
+
+    def to_internal_value(self, data):
+        if not isinstance(data, str) and hasattr(data, "__iter__"):
+            self.child_relation.prefetch(data)
+        return super().to_internal_value(data)
+
+
+class RecipeIngredientListSerializer(serializers.ListSerializer):
+
+    def to_internal_value(self, data):
+        if isinstance(data, list):
+            self.child.fields["id"].prefetch(
+                item.get("id") for item in data if isinstance(item, dict))
+        return super().to_internal_value(data)
 
 
 class TagSerializer(serializers.ModelSerializer):
@@ -23,7 +89,7 @@ class IngredientSerializer(serializers.ModelSerializer):
 
 
 class RecipeIngredientSerializer(serializers.ModelSerializer):
-    id = serializers.PrimaryKeyRelatedField(queryset=Ingredient.objects.all())
+    id = BulkPrimaryKeyRelatedField(queryset=Ingredient.objects.all())
     name = serializers.ReadOnlyField(source="ingredient.name")
     measurement_unit = serializers.ReadOnlyField(
         source="ingredient.measurement_unit")
@@ -32,6 +98,7 @@ class RecipeIngredientSerializer(serializers.ModelSerializer):
     class Meta:
         model = RecipeIngredient
         fields = ("id", "name", "measurement_unit", "amount")
+        list_serializer_class = RecipeIngredientListSerializer
 
     def validate_amount(self, amount):
         if amount < MIN_AMOUNT:
@@ -43,7 +110,7 @@ class RecipeIngredientSerializer(serializers.ModelSerializer):
 
 class RecipeCreateSerializer(serializers.ModelSerializer):
     ingredients = RecipeIngredientSerializer(many=True)
-    tags = serializers.PrimaryKeyRelatedField(
+    tags = BulkPrimaryKeyRelatedField(
         queryset=Tag.objects.all(), many=True)
     author = UserSerializer(read_only=True)
     image = Base64ImageField(max_length=None)
@@ -64,8 +131,11 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
         )
 
     def to_representation(self, instance):
+        request = self.context.get("request")
+        instance = Recipe.objects.with_related().with_user_flags(
+            request.user).get(pk=instance.pk)
         return RecipeReadSerializer(
-            instance, context={"request": self.context.get("request")}
+            instance, context={"request": request}
         ).data
 
     def validate(self, data):
@@ -109,24 +179,103 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
             for ingredient_data in ingredients
         ]
         RecipeIngredient.objects.bulk_create(ing_list)
+        log_changes("recipe_ingredients", [recipe.id])
 
+    @transaction.atomic
     def create(self, validated_data):
         tags = validated_data.pop("tags")
         ingredients = validated_data.pop("ingredients")
         recipe = Recipe.objects.create(**validated_data)
+        # Теги обязательны, поэтому в очередь пересчёта похожих рецепт
+        # ставит сигнал m2m_changed тегов.
         recipe.tags.set(tags)
         self.create_ingredients(recipe, ingredients)
+        index_recipes([recipe.pk])
         return recipe
 
-    def update(self, instance, validated_data):
-        instance.tags.clear()
-        instance.ingredients.clear()
+    @staticmethod
+    def update_tags(recipe, tags):
+        if set(recipe.tags.all()) != set(tags):
+            recipe.tags.set(tags)
 
-        ingredients = validated_data.pop("ingredients")
-        tags = validated_data.pop("tags")
-        instance.tags.set(tags)
-        self.create_ingredients(instance, ingredients)
-        return super().update(instance, validated_data)
+    @staticmethod
+    def update_ingredients(recipe, ingredients):
+        """Пишет только отличия от сохранённого состава рецепта.
+
+        Возвращает изменение количества каждого ингредиента.
+        """
+        old = {
+            recipe_ingredient.ingredient_id: recipe_ingredient
+            for recipe_ingredient in recipe.recipe_ingredients.all()
+        }
+        old_amounts = {
+            ingredient_id: recipe_ingredient.amount
+            for ingredient_id, recipe_ingredient in old.items()
+        }
+        new = {
+            ingredient_data["id"].id: ingredient_data["amount"]
+            for ingredient_data in ingredients
+        }
+        removed = old.keys() - new.keys()
+        if removed:
+            RecipeIngredient.objects.filter(
+                recipe=recipe, ingredient_id__in=removed).delete()
+        changed = []
+        for ingredient_id in old.keys() & new.keys():
+            if old_amounts[ingredient_id] != new[ingredient_id]:
+                old[ingredient_id].amount = new[ingredient_id]
+                changed.append(old[ingredient_id])
+        if changed:
+            RecipeIngredient.objects.bulk_update(changed, ["amount"])
+        added = new.keys() - old.keys()
+        if added:
+            RecipeIngredient.objects.bulk_create(
+                RecipeIngredient(recipe=recipe, ingredient_id=ingredient_id,
+                                 amount=new[ingredient_id])
+                for ingredient_id in added
+            )
+        if removed or added:
+            log_changes("recipe_ingredients", [recipe.id])
+            mark_stale([recipe.id])
+        return {
+            ingredient_id:
+                new.get(ingredient_id, 0) - old_amounts.get(ingredient_id, 0)
+            for ingredient_id in old.keys() | new.keys()
+        }
+
+    @staticmethod
+    def image_unchanged(recipe, image):
+        if not recipe.image or recipe.image.size != image.size:
+            return False
+        with recipe.image.open("rb") as stored:
+            unchanged = stored.read() == image.read()
+        image.seek(0)
+        return unchanged
+
+    @transaction.atomic
+    def update(self, instance, validated_data):
+        self.update_tags(instance, validated_data.pop("tags"))
+        amounts = self.update_ingredients(
+            instance, validated_data.pop("ingredients"))
+        ShoppingListItem.objects.apply(
+            ShoppingCart.objects.filter(recipe=instance).values_list(
+                "user_id", flat=True),
+            amounts,
+        )
+        image = validated_data.pop("image", None)
+        if image is not None and not self.image_unchanged(instance, image):
+            validated_data["image"] = image
+        changed = [
+            field for field, value in validated_data.items()
+            if field == "image" or getattr(instance, field) != value
+        ]
+        for field in changed:
+            setattr(instance, field, validated_data[field])
+        if changed:
+            instance.save(update_fields=changed)
+        index_recipes([instance.pk])
+        invalidate_recipe(instance.pk, instance.author_id)
+        return instance
 
 
 class RecipeSmallSerializer(serializers.ModelSerializer):
@@ -135,7 +284,7 @@ class RecipeSmallSerializer(serializers.ModelSerializer):
         fields = FollowRecipeSerializer.Meta.fields
 
 
-class RecipeReadSerializer(serializers.ModelSerializer):
+class RecipeReadSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     tags = TagSerializer(many=True, read_only=False)
     ingredients = serializers.SerializerMethodField()
     is_favorited = serializers.SerializerMethodField()
@@ -162,62 +311,58 @@ class RecipeReadSerializer(serializers.ModelSerializer):
         return RecipeIngredientSerializer(ingredients, many=True).data
 
     def get_is_favorited(self, obj):
+        if hasattr(obj, "is_favorited"):
+            return obj.is_favorited
         request = self.context.get("request")
-
-        return (
-            request.user.is_authenticated
-            and obj.favorites.filter(user=request.user).exists()
-
+        return request.user.is_authenticated and obj.id in per_request(
+            request, "favorite_ids",
+            lambda: set(request.user.favorites.values_list(
+                "recipe_id", flat=True)),
         )
 
     def get_is_in_shopping_cart(self, obj):
+        if hasattr(obj, "is_in_shopping_cart"):
+            return obj.is_in_shopping_cart
         request = self.context.get("request")
-        return (
-            request.user.is_authenticated
-            and request.user.shopping_carts.filter(recipe=obj).exists()
+        return request.user.is_authenticated and obj.id in per_request(
+            request, "shopping_cart_ids",
+            lambda: set(request.user.shopping_carts.values_list(
+                "recipe_id", flat=True)),
         )
 
 
-class FavoriteSerializer(serializers.ModelSerializer):
-
-    class Meta:
-        model = Favorite
-        fields = ("user", "recipe")
-
-    def validate(self, data):
-        user = data["user"]
-        if user.favorites.filter(recipe=data["recipe"]).exists():
-            raise serializers.ValidationError("Рецепт уже есть в избранном")
-        return data
-
-    def to_representation(self, instance):
-        return RecipeSmallSerializer(
-            instance.recipe, context={
-                'request': self.context.get('request')
-            }
-        ).data
-
-
-class ShoppingCartSerializer(serializers.ModelSerializer):
-
-    class Meta:
-        model = ShoppingCart
-        fields = ("user", "recipe")
-
-    def validate(self, data):
-        user = data["user"]
-        recipe_id = data["recipe"].id
-        if (
-            ShoppingCart.objects.filter(
-                user=user, recipe__id=recipe_id).exists()
-        ):
-            raise serializers.ValidationError(
-                "Рецепт уже добавлен в список покупок")
-        return data
-
-    def to_representation(self, instance):
-        return RecipeSmallSerializer(
-            instance.recipe, context={
-                'request': self.context.get('request')
-            }
-        ).data
+class RecipeIdsSerializer(serializers.Serializer):
+    recipes = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=RECIPES_BATCH_MAX_SIZE,
+    )
+
+
+class BatchRequestsSerializer(serializers.Serializer):
+    requests = serializers.ListField(
+        child=serializers.CharField(),
+        allow_empty=False,
+        max_length=API_BATCH_MAX_REQUESTS,
+    )
+
+    def validate_requests(self, value):
+        batch_path = reverse("batch")
+        for path in value:
+            url = urlsplit(path)
+            if (
+                url.scheme or url.netloc or not url.path.startswith("/api/")
+                or url.path == batch_path
+            ):
+                raise serializers.ValidationError(
+                    f"Недопустимый адрес подзапроса: {path}")
+        return value
+
+
+class PantrySerializer(serializers.Serializer):
+    ingredients = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=PANTRY_MAX_INGREDIENTS,
+    )
+    missing = serializers.IntegerField(min_value=0, required=False)
@@ -0,0 +1,99 @@
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete)
+from django.dispatch import receiver
+
+from recipes.cache import bump_version, invalidate_recipe, log_changes
+from recipes.models import (Ingredient, Recipe, RecipeIngredient,
+                            ShoppingCart, ShoppingListItem, Tag)
+from recipes.search import index_recipes
+from recipes.similarity import mark_stale
+from users.models import User
+
+AUTHOR_FIELDS = {"email", "username", "first_name", "last_name"}
+
+
+@receiver([post_save, post_delete], sender=Ingredient)
+def invalidate_ingredients(**kwargs):
+    bump_version("ingredients")
+
+
+@receiver(post_save, sender=Ingredient)
+def reindex_ingredient_recipes(instance, created, **kwargs):
+    if not created:
+        index_recipes(list(RecipeIngredient.objects.filter(
+            ingredient=instance).values_list("recipe_id", flat=True)))
+
+
+@receiver([post_save, post_delete], sender=RecipeIngredient)
+def invalidate_recipe_ingredients(instance, origin=None, **kwargs):
+    log_changes("recipe_ingredients", [instance.recipe_id])
+    # Queryset строк удаляет сериализатор, он ставит рецепт в очередь
+    # сам. Удалённый вместе с автором или рецептом рецепт в очередь
+    # ставить нельзя, а удаление ингредиента меняет состав рецептов.
+    if origin is None or isinstance(origin, RecipeIngredient) or getattr(
+        origin, "model", type(origin)
+    ) is Ingredient:
+        mark_stale([instance.recipe_id])
+    # Автор известен, если рецепт уже загружен (инлайны админки). При
+    # удалении рецепта ответы автора сбрасывает сигнал самого рецепта,
+    # сериализатор сбрасывает их явно.
+    invalidate_recipe(
+        instance.recipe_id,
+        instance.recipe.author_id
+        if RecipeIngredient.recipe.is_cached(instance) else None,
+    )
+
+
+@receiver([post_save, post_delete], sender=Recipe)
+def invalidate_recipe_responses(instance, **kwargs):
+    invalidate_recipe(instance.pk, instance.author_id)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def invalidate_recipe_tags(instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith("post_"):
+        return
+    if reverse:
+        bump_version("tags")
+        if pk_set:
+            mark_stale(pk_set)
+    else:
+        invalidate_recipe(instance.pk, instance.author_id)
+        mark_stale([instance.pk])
+
+
+@receiver(post_delete, sender=Recipe)
+def unindex_recipe(instance, **kwargs):
+    index_recipes([instance.pk])
+
+
+@receiver(post_save, sender=User)
+def invalidate_author_recipes(instance, created, update_fields, **kwargs):
+    """Имя и почта автора есть в закэшированных ответах с его рецептами.
+
+    Версия автора входит в ключи его рецептов и списка с фильтром author,
+    поэтому одного сдвига хватает на все эти ответы.
+    """
+    if created or (
+        update_fields is not None and not AUTHOR_FIELDS & set(update_fields)
+    ):
+        return
+    bump_version(f"recipes_author_{instance.pk}")
+
+
+@receiver([post_save, post_delete], sender=Tag)
+def invalidate_tags(**kwargs):
+    bump_version("tags")
+
+
+@receiver(post_save, sender=ShoppingCart)
+def add_to_shopping_list(instance, created, **kwargs):
+    if created:
+        ShoppingListItem.objects.add_recipes(
+            [instance.user_id], [instance.recipe_id])
+
+
+@receiver(pre_delete, sender=ShoppingCart)
+def remove_from_shopping_list(instance, **kwargs):
+    ShoppingListItem.objects.add_recipes(
+        [instance.user_id], [instance.recipe_id], sign=-1)
@@ -0,0 +1,165 @@
+import heapq
+from collections import defaultdict
+
+from django.db.models import Count
+
+from recipes.constants import (SIMILAR_BATCH_SIZE, SIMILAR_MAX_POSTINGS,
+                               SIMILAR_RECIPES_COUNT, SIMILAR_TAG_WEIGHT)
+from recipes.models import Recipe, RecipeIngredient, StaleSimilarRecipe
+
+
+def jaccard(left, right):
+    if not left or not right:
+        return 0.0
+    common = len(left & right)
+    return common / (len(left) + len(right) - common)
+
+
+def batches(items, size=SIMILAR_BATCH_SIZE):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def mark_stale(recipe_ids):
+    """Ставит рецепты в очередь пересчёта похожих.
+
+    Вызывается там, где меняется набор ингредиентов или тегов рецепта:
+    в сериализаторе, в сигналах RecipeIngredient и тегов и при импорте.
+    """
+    StaleSimilarRecipe.objects.bulk_create(
+        [StaleSimilarRecipe(recipe_id=recipe_id) for recipe_id in recipe_ids],
+        ignore_conflicts=True,
+    )
+
+
+class SimilarityMatrix:
+    """Разреженная матрица рецепт x ингредиент в памяти процесса.
+
+    Каждый рецепт хранится множеством ингредиентов и множеством тегов,
+    а для ингредиентов строятся списки рецептов. Кандидаты в похожие
+    находятся по спискам ингредиентов рецепта, поэтому сравниваются
+    только рецепты с общими ингредиентами. Ингредиенты, которые есть
+    больше чем в SIMILAR_MAX_POSTINGS рецептах (соль, вода), учитываются
+    в сходстве, но кандидатов не порождают.
+
+    Без recipe_ids загружается вся матрица, иначе - только рецепты
+    recipe_ids и рецепты с общими с ними ингредиентами; окрестность
+    других рецептов догружает load_neighbourhood.
+    """
+
+    def __init__(self, recipe_ids=None):
+        self.ingredients = {}
+        self.tags = {}
+        self.postings = {}
+        self.frequent = set()
+        if recipe_ids is not None:
+            self.load_neighbourhood(recipe_ids)
+            return
+        ingredients = defaultdict(set)
+        postings = defaultdict(list)
+        for recipe_id, ingredient_id in RecipeIngredient.objects.values_list(
+            "recipe_id", "ingredient_id"
+        ).order_by().iterator():
+            ingredients[recipe_id].add(ingredient_id)
+            postings[ingredient_id].append(recipe_id)
+        tags = defaultdict(set)
+        for recipe_id, tag_id in Recipe.tags.through.objects.values_list(
+            "recipe_id", "tag_id"
+        ).order_by().iterator():
+            tags[recipe_id].add(tag_id)
+        self.ingredients = {
+            recipe_id: frozenset(ids) for recipe_id, ids in ingredients.items()
+        }
+        self.tags = {
+            recipe_id: frozenset(ids) for recipe_id, ids in tags.items()
+        }
+        for ingredient_id, recipe_ids in postings.items():
+            if len(recipe_ids) <= SIMILAR_MAX_POSTINGS:
+                self.postings[ingredient_id] = recipe_ids
+            else:
+                self.frequent.add(ingredient_id)
+
+    def load_recipes(self, recipe_ids):
+        """Догружает составы и теги рецептов, которых ещё нет в матрице."""
+        missing = [
+            recipe_id for recipe_id in recipe_ids
+            if recipe_id not in self.ingredients
+        ]
+        for batch in batches(missing):
+            ingredients = defaultdict(set)
+            for recipe_id, ingredient_id in RecipeIngredient.objects.filter(
+                recipe_id__in=batch
+            ).values_list("recipe_id", "ingredient_id").order_by():
+                ingredients[recipe_id].add(ingredient_id)
+            tags = defaultdict(set)
+            for recipe_id, tag_id in Recipe.tags.through.objects.filter(
+                recipe_id__in=batch
+            ).values_list("recipe_id", "tag_id").order_by():
+                tags[recipe_id].add(tag_id)
+            for recipe_id in batch:
+                self.ingredients[recipe_id] = frozenset(
+                    ingredients[recipe_id])
+                self.tags[recipe_id] = frozenset(tags[recipe_id])
+
+    def load_neighbourhood(self, recipe_ids):
+        """Догружает рецепты recipe_ids и всех их кандидатов в похожие."""
+        self.load_recipes(recipe_ids)
+        missing = sorted({
+            ingredient_id
+            for recipe_id in recipe_ids
+            for ingredient_id in self.ingredients[recipe_id]
+        } - self.postings.keys() - self.frequent)
+        candidates = set()
+        for batch in batches(missing):
+            counts = dict(RecipeIngredient.objects.filter(
+                ingredient_id__in=batch
+            ).values_list("ingredient_id").annotate(
+                count=Count("id")).order_by())
+            self.frequent.update(
+                ingredient_id for ingredient_id in batch
+                if counts.get(ingredient_id, 0) > SIMILAR_MAX_POSTINGS
+            )
+            postings = defaultdict(list)
+            for ingredient_id, recipe_id in RecipeIngredient.objects.filter(
+                ingredient_id__in=[
+                    ingredient_id for ingredient_id in batch
+                    if ingredient_id not in self.frequent
+                ]
+            ).values_list("ingredient_id", "recipe_id").order_by():
+                postings[ingredient_id].append(recipe_id)
+                candidates.add(recipe_id)
+            self.postings.update(postings)
+        self.load_recipes(candidates)
+
+    def score(self, recipe_id, other_id):
+        """Сходство по Жаккару составов, усиленное общими тегами."""
+        empty = frozenset()
+        return jaccard(
+            self.ingredients.get(recipe_id, empty),
+            self.ingredients.get(other_id, empty),
+        ) * (1 + SIMILAR_TAG_WEIGHT * jaccard(
+            self.tags.get(recipe_id, empty), self.tags.get(other_id, empty)
+        ))
+
+    def scores(self, recipe_id):
+        """Сходство с каждым рецептом, у которого есть общие ингредиенты."""
+        candidates = {
+            other_id
+            for ingredient_id in self.ingredients.get(recipe_id, ())
+            for other_id in self.postings.get(ingredient_id, ())
+        }
+        candidates.discard(recipe_id)
+        return {
+            other_id: self.score(recipe_id, other_id)
+            for other_id in candidates
+        }
+
+    def top(self, recipe_id, scores=None):
+        """Пары (сходство, id) самых похожих рецептов, лучшие первыми."""
+        if scores is None:
+            scores = self.scores(recipe_id)
+        return heapq.nlargest(
+            SIMILAR_RECIPES_COUNT,
+            ((score, other_id) for other_id, score in scores.items()),
+        )
@@ -0,0 +1,289 @@
+import io
+import json
+import re
+from unittest import mock, skipUnless
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory, APITestCase
+
+from recipes.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
+                            ShoppingCart, ShoppingListItem, Tag)
+from recipes.renderers import FastJSONRenderer
+from recipes.representations import list_queryset, recipe_list_data
+from recipes.search import ingredient_index
+from recipes.serializers import RecipeReadSerializer
+from users.models import Follow, User
+
+BATCH_PATHS = (
+    "/api/users/me/",
+    "/api/users/subscriptions/",
+    "/api/users/",
+    "/api/tags/",
+    "/api/ingredients/",
+    "/api/recipes/",
+    "/api/recipes/feed/",
+    "/api/recipes/download_shopping_cart/",
+    "/api/recipes/{recipe}/",
+    "/api/recipes/0/",
+)
+
+
+class BatchTests(APITestCase):
+    """Подзапросы /api/batch/ отвечают так же, как прямые запросы."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(
+            username="cook", email="cook@example.com", first_name="Имя",
+            last_name="Фамилия",
+        )
+        cls.token = Token.objects.create(user=cls.user)
+        cls.recipe = Recipe.objects.create(
+            author=cls.user, name="Суп", text="Описание", cooking_time=10)
+        cls.paths = [
+            path.format(recipe=cls.recipe.id) for path in BATCH_PATHS]
+
+    def assert_same_statuses(self):
+        response = self.client.post(
+            "/api/batch/", {"requests": self.paths}, format="json")
+        self.assertEqual(response.status_code, 200)
+        batched = [
+            item["status"] for item in response.json()["responses"]]
+        direct = [
+            self.client.get(path, HTTP_ACCEPT="application/json").status_code
+            for path in self.paths
+        ]
+        self.assertEqual(batched, direct)
+        return dict(zip(self.paths, batched))
+
+    def test_anonymous_statuses(self):
+        statuses = self.assert_same_statuses()
+        self.assertEqual(statuses["/api/users/me/"], 401)
+        self.assertEqual(statuses["/api/users/subscriptions/"], 401)
+
+    def test_token_statuses(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {self.token.key}")
+        statuses = self.assert_same_statuses()
+        self.assertEqual(statuses["/api/users/me/"], 200)
+
+    def test_invalid_token(self):
+        self.client.credentials(HTTP_AUTHORIZATION="Token invalid")
+        response = self.client.post(
+            "/api/batch/", {"requests": ["/api/tags/"]}, format="json")
+        self.assertEqual(response.status_code, 401)
+
+    @mock.patch("recipes.utils.STREAM_BLOCK_SIZE", 16)
+    def test_streamed_shopping_cart(self):
+        for number in range(5):
+            ShoppingListItem.objects.create(
+                user=self.user, amount=number + 1,
+                ingredient=Ingredient.objects.create(
+                    name=f"ингредиент {number}", measurement_unit="г"),
+            )
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {self.token.key}")
+        path = "/api/recipes/download_shopping_cart/"
+        direct = self.client.get(path, HTTP_ACCEPT="application/json")
+        self.assertTrue(direct.streaming)
+        response = self.client.post(
+            "/api/batch/", {"requests": [path]}, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["responses"], [{
+            "status": 200,
+            "body": [
+                {"name": f"ингредиент {number}", "measurement_unit": "г",
+                 "amount": number + 1}
+                for number in range(5)
+            ],
+        }])
+
+    def test_failed_sub_request(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {self.token.key}")
+        with mock.patch.object(
+            ingredient_index, "search", side_effect=RuntimeError
+        ), self.assertLogs(level="ERROR"):
+            response = self.client.post("/api/batch/", {"requests": [
+                "/api/ingredients/?name=соль", "/api/users/me/",
+            ]}, format="json")
+        self.assertEqual(response.status_code, 200)
+        failed, me = response.json()["responses"]
+        self.assertEqual(failed["status"], 500)
+        self.assertEqual(me["status"], 200)
+
+
+class RecipeRepresentationTests(APITestCase):
+    """Быстрый путь списка рецептов совпадает с RecipeReadSerializer."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create(
+            username="author", email="author@example.com",
+            first_name="Автор", last_name="Рецептов",
+        )
+        cls.user = User.objects.create(
+            username="reader", email="reader@example.com",
+            first_name="Читатель", last_name="Рецептов",
+        )
+        tags = [
+            Tag.objects.create(
+                name=f"тег {number}", color=f"#00000{number}",
+                slug=f"tag-{number}",
+            )
+            for number in range(2)
+        ]
+        ingredients = [
+            Ingredient.objects.create(
+                name=f"ингредиент {number}", measurement_unit="г")
+            for number in range(3)
+        ]
+        for number in range(4):
+            recipe = Recipe.objects.create(
+                author=cls.author if number % 2 else cls.user,
+                name=f"рецепт {number}", text="Описание",
+                cooking_time=number + 1, image=f"images/{number}.png",
+            )
+            recipe.tags.set(tags[:number % 2 + 1])
+            RecipeIngredient.objects.bulk_create(
+                RecipeIngredient(
+                    recipe=recipe, ingredient=ingredient, amount=amount)
+                for amount, ingredient in enumerate(
+                    ingredients[number % 3:], 1)
+            )
+        Favorite.objects.create(user=cls.user, recipe=recipe)
+        ShoppingCart.objects.create(user=cls.user, recipe=recipe)
+        Follow.objects.create(follower=cls.user, following=cls.author)
+
+    def assert_same_list(self, user, params=None):
+        """Сверяет байт в байт ответы быстрого пути и сериализатора."""
+        request = Request(APIRequestFactory().get("/api/recipes/", params))
+        request.user = user
+        fields = RecipeReadSerializer.requested_fields(request)
+        recipes = Recipe.objects.with_user_flags(user, fields).order_by(
+            "-pub_date", "-id")
+        expected = RecipeReadSerializer(
+            recipes.with_related(fields), many=True,
+            context={"request": request}, fields=fields,
+        ).data
+        actual = recipe_list_data(
+            list(list_queryset(recipes, user, fields)), request, fields)
+        self.assertEqual(
+            [FastJSONRenderer().render(recipe).decode()
+             for recipe in actual],
+            [JSONRenderer().render(recipe).decode() for recipe in expected],
+        )
+
+    def test_anonymous(self):
+        self.assert_same_list(AnonymousUser())
+
+    def test_user(self):
+        self.assert_same_list(self.user)
+
+    def test_fields(self):
+        self.assert_same_list(
+            self.user, {"fields": "id,name,image,cooking_time,tags"})
+
+    def test_omit(self):
+        self.assert_same_list(self.user, {"omit": "ingredients,text"})
+
+
+def sqlite_problems(plan, table):
+    problems = []
+    for line in plan.splitlines():
+        if "TEMP B-TREE" in line:
+            problems.append("сортировка")
+        match = re.search(r"\b(SCAN|SEARCH) (\w+)", line)
+        if not match:
+            continue
+        if match[2] != table:
+            problems.append(f"соединение с {match[2]}")
+        elif match[1] == "SCAN" and "COVERING INDEX" not in line:
+            problems.append("полный просмотр таблицы")
+    if "INDEX" not in plan:
+        problems.append("индекс не используется")
+    return problems
+
+
+def postgresql_nodes(node):
+    yield node
+    for child in node.get("Plans", ()):
+        yield from postgresql_nodes(child)
+
+
+def postgresql_problems(plan, table):
+    problems = []
+    uses_index = False
+    for node in postgresql_nodes(json.loads(plan)[0]["Plan"]):
+        node_type = node["Node Type"]
+        relation = node.get("Relation Name")
+        if relation and relation != table:
+            problems.append(f"соединение с {relation}")
+        if node_type == "Seq Scan":
+            problems.append("полный просмотр таблицы")
+        elif node_type in ("Sort", "Incremental Sort"):
+            problems.append("сортировка")
+        elif "Index" in node_type:
+            uses_index = True
+    if not uses_index:
+        problems.append("индекс не используется")
+    return problems
+
+
+@skipUnless(
+    connection.vendor in ("postgresql", "sqlite"),
+    "планы запросов разбираются только для PostgreSQL и SQLite",
+)
+class QueryPlanTests(TestCase):
+    """Частые запросы читают одну таблицу по индексу.
+
+    Без полного просмотра, соединений с другими таблицами и сортировки.
+    """
+
+    def hot_queries(self):
+        return (
+            ("favorite-exists",
+             Favorite.objects.filter(user_id=1, recipe_id=1)),
+            ("cart-exists",
+             ShoppingCart.objects.filter(user_id=1, recipe_id=1)),
+            ("favorites-by-user",
+             Favorite.objects.filter(user_id=1).values_list("recipe_id")),
+            ("cart-by-user",
+             ShoppingCart.objects.filter(user_id=1).values_list(
+                 "recipe_id")),
+            ("following-by-follower",
+             Follow.objects.filter(follower_id=1).values_list(
+                 "following_id")),
+            ("followers-by-author",
+             Follow.objects.filter(following_id=1).values_list(
+                 "follower_id")),
+            ("recipes-by-author",
+             Recipe.objects.filter(author_id=1).values_list(
+                 "id", "pub_date")),
+        )
+
+    def problems(self, queryset):
+        table = queryset.model._meta.db_table
+        if connection.vendor == "sqlite":
+            return sqlite_problems(queryset.explain(), table)
+        # На маленьких таблицах планировщик выбирает полный просмотр,
+        # даже если индекс есть, поэтому он запрещается на время проверки.
+        with connection.cursor() as cursor:
+            cursor.execute("SET LOCAL enable_seqscan = off")
+        return postgresql_problems(queryset.explain(format="json"), table)
+
+    def test_hot_queries_use_indexes(self):
+        for name, queryset in self.hot_queries():
+            with self.subTest(name):
+                self.assertEqual(self.problems(queryset), [])
+
+
+class QueryBudgetTests(TestCase):
+    """Маршруты API укладываются в бюджеты запросов из bench_api."""
+
+    def test_routes_within_budget(self):
+        call_command("bench_api", "--repeat", "1", stdout=io.StringIO(),
+                     stderr=io.StringIO())
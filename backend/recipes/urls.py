@@ -1,7 +1,8 @@
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 
-from recipes.views import IngredientViewSet, RecipeViewSet, TagViewSet
+from recipes.views import (BatchView, IngredientViewSet, RecipeViewSet,
+                           TagViewSet)
 
 router = DefaultRouter()
 router.register("ingredients", IngredientViewSet, "ingredients")
@@ -9,4 +10,7 @@ router.register("tags", TagViewSet, "tags")
 router.register("recipes", RecipeViewSet, "recipes")
 
 
-urlpatterns = [path("", include(router.urls))]
+urlpatterns = [
+    path("batch/", BatchView.as_view(), name="batch"),
+    path("", include(router.urls)),
+]
@@ -1,45 +1,164 @@
-from django.http import FileResponse
+import csv
+import io
+import json
+import zlib
+from itertools import chain, islice
+
+from django.http import HttpResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from rest_framework import status
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 
+from recipes.cache import accepts_gzip
+from recipes.constants import SHOPPING_CART_CHUNK_SIZE, STREAM_BLOCK_SIZE
 from recipes.models import Recipe
+from recipes.serializers import RecipeIdsSerializer, RecipeSmallSerializer
+
+
+def query_list(request, name):
+    """Значения параметра через запятую или повтором параметра."""
+    return [
+        value
+        for values in request.query_params.getlist(name)
+        for value in values.split(",") if value
+    ]
+
 
+def shopping_or_favorite(request, pk, model, message):
+    """Добавляет рецепт в избранное или корзину.
 
-def shopping_or_favorite(request, pk, serializer):
-    user = request.user
-    context = {"request": request}
+    Рецепт для ответа читается одним запросом, строка добавляется одной
+    вставкой без предварительной проверки exists.
+    """
     try:
-        recipe = Recipe.objects.get(id=pk)
+        recipe = Recipe.objects.only(
+            *RecipeSmallSerializer.Meta.fields).get(pk=pk)
     except Recipe.DoesNotExist:
         return Response(status=status.HTTP_400_BAD_REQUEST)
-
-    data = {"user": user.id, "recipe": recipe.id}
-    serializer = serializer(data=data, context=context)
-    serializer.is_valid(raise_exception=True)
-    serializer.save()
-    return Response(serializer.data, status=status.HTTP_201_CREATED)
+    if not model.objects.add(request.user.id, [recipe.id]):
+        raise ValidationError({api_settings.NON_FIELD_ERRORS_KEY: [message]})
+    return Response(
+        RecipeSmallSerializer(recipe, context={"request": request}).data,
+        status=status.HTTP_201_CREATED,
+    )
 
 
 def favorite_or_shopping_delete(request, pk, model):
-    mod = model.objects.filter(user=request.user, recipe=get_object_or_404(
-        Recipe, id=pk)
-    )
-    if mod.exists():
-        mod.delete()
+    """Удаляет рецепт из избранного или корзины одним запросом.
+
+    Рецепт ищется только если удалять было нечего, чтобы отличить
+    отсутствующий рецепт от рецепта не из списка.
+    """
+    if model.objects.remove(request.user.id, [pk]):
         return Response(status=status.HTTP_204_NO_CONTENT)
+    get_object_or_404(Recipe.objects.only("id"), id=pk)
     return Response(status=status.HTTP_400_BAD_REQUEST)
 
 
-def shopping_cart_file(request, ingredients):
-    shopping_list = ["Список покупок:\n"]
+def favorite_or_shopping_batch(request, model):
+    """Добавляет (POST) или удаляет (DELETE) пачку рецептов.
+
+    Возвращает id изменённых рецептов и id пропущенных: уже добавленных,
+    отсутствующих в списке или несуществующих.
+    """
+    serializer = RecipeIdsSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    recipe_ids = list(dict.fromkeys(serializer.validated_data["recipes"]))
+    if request.method == "POST":
+        key, changed = "added", model.objects.add(
+            request.user.id, recipe_ids)
+    else:
+        key, changed = "removed", model.objects.remove(
+            request.user.id, recipe_ids)
+    changed = set(changed)
+    return Response({
+        key: [pk for pk in recipe_ids if pk in changed],
+        "skipped": [pk for pk in recipe_ids if pk not in changed],
+    })
+
+
+def shopping_cart_txt(ingredients):
+    yield "Список покупок:\n"
     for ingredient in ingredients:
         name = ingredient["ingredient__name"]
         unit = ingredient["ingredient__measurement_unit"]
         amount = ingredient["ingredient_amount"]
-        shopping_list.append(f"\n{name} - {amount}, {unit}")
-    response = FileResponse(shopping_list, content_type="text/plain")
+        yield f"\n{name} - {amount}, {unit}"
+
+
+def shopping_cart_csv(ingredients):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(("name", "measurement_unit", "amount"))
+    for ingredient in ingredients:
+        writer.writerow((
+            ingredient["ingredient__name"],
+            ingredient["ingredient__measurement_unit"],
+            ingredient["ingredient_amount"],
+        ))
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def shopping_cart_json(ingredients):
+    separator = "["
+    for ingredient in ingredients:
+        yield separator + json.dumps({
+            "name": ingredient["ingredient__name"],
+            "measurement_unit": ingredient["ingredient__measurement_unit"],
+            "amount": ingredient["ingredient_amount"],
+        }, ensure_ascii=False)
+        separator = ","
+    yield "[]" if separator == "[" else "]"
+
+
+SHOPPING_CART_WRITERS = {
+    "txt": shopping_cart_txt,
+    "csv": shopping_cart_csv,
+    "json": shopping_cart_json,
+}
+
+
+def encode_blocks(chunks, compress):
+    """Склеивает текстовые куски в блоки байт, при compress сжимает gzip."""
+    compressor = zlib.compressobj(wbits=31) if compress else None
+    block = bytearray()
+    for chunk in chunks:
+        data = chunk.encode()
+        block += compressor.compress(data) if compressor else data
+        if len(block) >= STREAM_BLOCK_SIZE:
+            yield bytes(block)
+            block.clear()
+    if compressor:
+        block += compressor.flush()
+    if block:
+        yield bytes(block)
+
+
+def shopping_cart_file(request, ingredients):
+    file_format = request.accepted_renderer.format
+    compress = accepts_gzip(request)
+    blocks = encode_blocks(
+        SHOPPING_CART_WRITERS[file_format](
+            ingredients.iterator(chunk_size=SHOPPING_CART_CHUNK_SIZE)),
+        compress,
+    )
+    head = list(islice(blocks, 2))
+    content_type = f"{request.accepted_renderer.media_type}; charset=utf-8"
+    if len(head) < 2:
+        response = HttpResponse(b"".join(head), content_type=content_type)
+        response["Content-Length"] = len(response.content)
+    else:
+        response = StreamingHttpResponse(chain(head, blocks),
+                                         content_type=content_type)
+    if compress:
+        response["Content-Encoding"] = "gzip"
+    response["Vary"] = "Accept-Encoding"
     response["Content-Disposition"] = (
-        'attachment; filename="shopping_cart.txt"'
+        f'attachment; filename="shopping_cart.{file_format}"'
     )
     return response
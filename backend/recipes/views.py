@@ -1,19 +1,38 @@
-from django.db.models import Sum
+from django.db import transaction
+from django.db.models import F
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import mixins, viewsets
 from rest_framework.decorators import action
-from rest_framework.permissions import IsAuthenticated
-
-from recipes.filters import IngredientsSearchFilter, RecipeFilter
-from recipes.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
-                            ShoppingCart, Tag)
+from rest_framework.exceptions import ValidationError
+from rest_framework.generics import get_object_or_404
+from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.renderers import BrowsableAPIRenderer, JSONRenderer
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from recipes.batch import run_batch
+from recipes.cache import AnonymousCacheMixin, CachedListMixin
+from recipes.constants import (INGREDIENTS_SEARCH_LIMIT,
+                               INGREDIENTS_SEARCH_MAX_LIMIT)
+from recipes.feed import feed_entries, publish
+from recipes.filters import RecipeFilter
+from recipes.models import (Favorite, Ingredient, Recipe, ShoppingCart,
+                            ShoppingListItem, Tag)
 from recipes.permissions import IsAuthorOrReadOnly
-from recipes.serializers import (FavoriteSerializer, IngredientSerializer,
-                                 RecipeCreateSerializer, RecipeReadSerializer,
-                                 ShoppingCartSerializer, TagSerializer)
-from recipes.utils import (favorite_or_shopping_delete, shopping_cart_file,
-                           shopping_or_favorite)
-from users.pagination import UserRecipePagination
+from recipes.renderers import (FastJSONRenderer, ShoppingCartCSVRenderer,
+                               ShoppingCartTextRenderer)
+from recipes.representations import (FastRecipeListMixin, list_queryset,
+                                     recipe_list_data)
+from recipes.search import ingredient_index, pantry_index
+from recipes.serializers import (BatchRequestsSerializer,
+                                 IngredientSerializer, PantrySerializer,
+                                 RecipeCreateSerializer, RecipeIdsSerializer,
+                                 RecipeReadSerializer, RecipeSmallSerializer,
+                                 TagSerializer)
+from recipes.utils import (favorite_or_shopping_batch,
+                           favorite_or_shopping_delete, query_list,
+                           shopping_cart_file, shopping_or_favorite)
+from users.pagination import RecipePagination, UserRecipePagination
 
 
 class GETViewSet(
@@ -22,39 +41,146 @@ class GETViewSet(
     pass
 
 
-class IngredientViewSet(GETViewSet):
+class IngredientViewSet(CachedListMixin, GETViewSet):
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
-    filter_backends = (IngredientsSearchFilter,)
-    search_fields = ("^name",)
+    cache_version_name = "ingredients"
+
+    def list(self, request, *args, **kwargs):
+        name = request.query_params.get("name")
+        if not name:
+            return super().list(request, *args, **kwargs)
+        limit = request.query_params.get("limit", "")
+        limit = (
+            min(int(limit), INGREDIENTS_SEARCH_MAX_LIMIT)
+            if limit.isdigit() and int(limit) > 0
+            else INGREDIENTS_SEARCH_LIMIT
+        )
+        return Response(ingredient_index.search(name, limit))
 
 
-class TagViewSet(GETViewSet):
+class TagViewSet(CachedListMixin, GETViewSet):
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
+    cache_version_name = "tags"
 
 
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(
+    AnonymousCacheMixin, FastRecipeListMixin, viewsets.ModelViewSet
+):
     queryset = Recipe.objects.all()
-    pagination_class = UserRecipePagination
+    renderer_classes = [FastJSONRenderer, BrowsableAPIRenderer]
+    lookup_value_regex = r"\d+"
+    pagination_class = RecipePagination
     ordering_fields = ("-pub_date",)
     permission_classes = [IsAuthorOrReadOnly]
     filter_backends = [DjangoFilterBackend]
     filterset_class = RecipeFilter
+    cache_query_params = (
+        "page", "limit", "cursor", "tags", "tags_mode", "author", "search",
+        "is_favorited", "is_in_shopping_cart", "fields", "omit",
+    )
+
+    def requested_fields(self):
+        """Поля ответа из ?fields= и ?omit= для GET, None - все поля."""
+        if self.request.method != "GET":
+            return None
+        return RecipeReadSerializer.requested_fields(self.request)
+
+    def get_queryset(self):
+        fields = self.requested_fields()
+        return Recipe.objects.with_related(fields).with_user_flags(
+            self.request.user, fields)
+
+    def get_serializer(self, *args, **kwargs):
+        if self.request.method == "GET":
+            kwargs.setdefault("fields", self.requested_fields())
+        return super().get_serializer(*args, **kwargs)
 
     def get_serializer_class(self):
         if self.request.method == "GET":
             return RecipeReadSerializer
         return RecipeCreateSerializer
 
+    @transaction.atomic
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
+        publish([serializer.instance])
+
+    @action(
+        detail=False, methods=["get"], permission_classes=[IsAuthenticated]
+    )
+    def feed(self, request):
+        paginator = UserRecipePagination()
+        page = paginator.paginate_queryset(
+            feed_entries(request.user), request, view=self)
+        recipes = self.get_queryset().in_bulk(
+            [recipe_id for recipe_id, _ in page])
+        serializer = self.get_serializer(
+            [recipes[recipe_id] for recipe_id, _ in page
+             if recipe_id in recipes],
+            many=True,
+        )
+        return paginator.get_paginated_response(serializer.data)
+
+    @action(detail=False, methods=["get"])
+    def batch(self, request):
+        """Рецепты по списку id в порядке запроса: ?ids=1,2,3.
+
+        Рецепты читаются так же, как в списке, несуществующие id
+        пропускаются.
+        """
+        serializer = RecipeIdsSerializer(
+            data={"recipes": query_list(request, "ids")})
+        if not serializer.is_valid():
+            raise ValidationError({"ids": serializer.errors["recipes"]})
+        ids = list(dict.fromkeys(serializer.validated_data["recipes"]))
+        fields = self.requested_fields()
+        recipes = list_queryset(
+            self.get_queryset(), request.user, fields).in_bulk(ids)
+        return Response(recipe_list_data(
+            [recipes[pk] for pk in ids if pk in recipes], request, fields))
+
+    @action(detail=False, methods=["get"])
+    def pantry(self, request):
+        """Рецепты, для которых хватает ингредиентов пользователя.
+
+        ingredients - id имеющихся ингредиентов через запятую или
+        повтором параметра, missing - сколько ингредиентов рецепта может
+        не хватать.
+        """
+        data = {"ingredients": query_list(request, "ingredients")}
+        if "missing" in request.query_params:
+            data["missing"] = request.query_params["missing"]
+        serializer = PantrySerializer(data=data)
+        serializer.is_valid(raise_exception=True)
+        paginator = UserRecipePagination()
+        page = paginator.paginate_queryset(
+            pantry_index.search(
+                serializer.validated_data["ingredients"],
+                serializer.validated_data.get("missing"),
+            ),
+            request, view=self,
+        )
+        recipes = self.get_queryset().in_bulk(page)
+        return paginator.get_paginated_response(self.get_serializer(
+            [recipes[pk] for pk in page if pk in recipes], many=True).data)
+
+    @action(detail=True, methods=["get"])
+    def similar(self, request, pk):
+        recipe = get_object_or_404(Recipe.objects.only("id"), pk=pk)
+        recipes = Recipe.objects.filter(similar_to__recipe=recipe).only(
+            *RecipeSmallSerializer.Meta.fields
+        ).order_by("-similar_to__score", "id")
+        return Response(RecipeSmallSerializer(
+            recipes, many=True, context={"request": request}).data)
 
     @action(
         detail=True, methods=["post"], permission_classes=[IsAuthenticated]
     )
     def favorite(self, request, pk):
-        return shopping_or_favorite(request, pk, FavoriteSerializer)
+        return shopping_or_favorite(
+            request, pk, Favorite, "Рецепт уже есть в избранном")
 
     @favorite.mapping.delete
     def delete_favorite(self, request, pk):
@@ -63,21 +189,58 @@ class RecipeViewSet(viewsets.ModelViewSet):
     @action(
         detail=True, methods=["post"], permission_classes=[IsAuthenticated])
     def shopping_cart(self, request, pk):
-        return shopping_or_favorite(request, pk, ShoppingCartSerializer)
+        return shopping_or_favorite(
+            request, pk, ShoppingCart, "Рецепт уже добавлен в список покупок")
 
     @shopping_cart.mapping.delete
     def delete_shopping_cart(self, request, pk):
         return favorite_or_shopping_delete(request, pk, ShoppingCart)
 
     @action(
-        detail=False, methods=["get"], permission_classes=[IsAuthenticated]
+        detail=False, methods=["post", "delete"], url_path="favorite",
+        permission_classes=[IsAuthenticated],
+    )
+    def favorite_batch(self, request):
+        """Избранное пачкой: {"recipes": [id, ...]}."""
+        return favorite_or_shopping_batch(request, Favorite)
+
+    @action(
+        detail=False, methods=["post", "delete"], url_path="shopping_cart",
+        permission_classes=[IsAuthenticated],
+    )
+    def shopping_cart_batch(self, request):
+        """Корзина пачкой, например весь план питания: {"recipes": [id]}."""
+        return favorite_or_shopping_batch(request, ShoppingCart)
+
+    @action(
+        detail=False, methods=["get"], permission_classes=[IsAuthenticated],
+        renderer_classes=[ShoppingCartTextRenderer, ShoppingCartCSVRenderer,
+                          JSONRenderer],
     )
     def download_shopping_cart(self, request):
         ingredients = (
-            RecipeIngredient.objects.filter(
-                recipe__shopping_carts__user=request.user
-            )
-            .values("ingredient__name", "ingredient__measurement_unit")
-            .annotate(ingredient_amount=Sum("amount"))
+            ShoppingListItem.objects.filter(user=request.user)
+            .values("ingredient__name", "ingredient__measurement_unit",
+                    ingredient_amount=F("amount"))
+            .order_by("ingredient__name", "ingredient__measurement_unit")
         )
         return shopping_cart_file(request, ingredients)
+
+
+class BatchView(APIView):
+    """Несколько GET-запросов к API одним запросом.
+
+    Тело: {"requests": ["/api/users/me/", "/api/recipes/?limit=6"]}.
+    Подзапросы выполняются с пользователем пакета и общим request_cache,
+    поэтому токен проверяется один раз, а множества избранного, корзины
+    и подписок пользователя читаются не больше одного раза на пакет.
+    """
+
+    permission_classes = [AllowAny]
+    renderer_classes = [FastJSONRenderer, BrowsableAPIRenderer]
+
+    def post(self, request):
+        serializer = BatchRequestsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return Response({"responses": run_batch(
+            request, serializer.validated_data["requests"])})
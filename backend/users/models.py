@@ -36,21 +36,27 @@ class User(AbstractUser):
 
 class Follow(models.Model):
     follower = models.ForeignKey(
-        User, on_delete=models.CASCADE, related_name="follower"
+        User, on_delete=models.CASCADE, related_name="follower",
+        db_index=False,
     )
     following = models.ForeignKey(
-        User, on_delete=models.CASCADE, related_name="following"
+        User, on_delete=models.CASCADE, related_name="following",
+        db_index=False,
     )
 
     class Meta:
         verbose_name = "Подписка"
-        ordering = ("following__username",)
+        ordering = ("follower_id", "following_id")
         constraints = [
             models.UniqueConstraint(
                 fields=['follower', 'following'],
                 name='unique_follower_following'
             )
         ]
+        indexes = [
+            models.Index(fields=("following", "follower"),
+                         name="follow_following_follower"),
+        ]
 
     def __str__(self):
         return f"{self.follower} подписан на {self.following}"
@@ -1,4 +1,11 @@
+from base64 import b64decode, urlsafe_b64encode
+from binascii import Error as BinasciiError
+
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
 from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 
 from recipes.constants import PAGE_SIZE
 
@@ -6,3 +13,85 @@ from recipes.constants import PAGE_SIZE
 class UserRecipePagination(PageNumberPagination):
     page_size = PAGE_SIZE
     page_size_query_param = "limit"
+
+
+class RecipePagination(UserRecipePagination):
+    """Постраничная выдача рецептов с курсором по (pub_date, id).
+
+    Без параметра cursor работает как обычная пагинация по номеру
+    страницы. С параметром cursor (пустым для первой страницы) страница
+    выбирается по ключу последнего показанного рецепта, без COUNT и
+    OFFSET, а ссылки next/previous содержат курсор.
+    """
+
+    cursor_query_param = "cursor"
+    invalid_cursor_message = "Неверный курсор"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = self.cursor_query_param in request.query_params
+        if not self.keyset:
+            return super().paginate_queryset(queryset, request, view)
+        self.request = request
+        page_size = self.get_page_size(request)
+        cursor = self.decode_cursor(
+            request.query_params[self.cursor_query_param])
+        queryset = queryset.order_by("-pub_date", "-id")
+        reverse = False
+        if cursor:
+            pub_date, pk, reverse = cursor
+            if reverse:
+                queryset = queryset.filter(pub_date__gte=pub_date).exclude(
+                    pub_date=pub_date, id__lte=pk
+                ).order_by("pub_date", "id")
+            else:
+                queryset = queryset.filter(pub_date__lte=pub_date).exclude(
+                    pub_date=pub_date, id__gte=pk)
+        page = list(queryset[:page_size + 1])
+        has_more = len(page) > page_size
+        page = page[:page_size]
+        if reverse:
+            page.reverse()
+        self.next_cursor = self.previous_cursor = None
+        if page:
+            if has_more or reverse:
+                self.next_cursor = (page[-1].pub_date, page[-1].id, False)
+            if cursor and (has_more or not reverse):
+                self.previous_cursor = (page[0].pub_date, page[0].id, True)
+        elif cursor:
+            pub_date, pk, reverse = cursor
+            self.previous_cursor = (pub_date, pk, not reverse)
+        return page
+
+    def decode_cursor(self, encoded):
+        if not encoded:
+            return None
+        try:
+            decoded = b64decode(encoded.encode(), altchars=b"-_",
+                                validate=True).decode()
+            reverse, pub_date, pk = decoded.split("|")
+            pub_date = parse_datetime(pub_date)
+            pk = int(pk)
+        except (BinasciiError, UnicodeDecodeError, ValueError) as err:
+            raise NotFound(self.invalid_cursor_message) from err
+        if pub_date is None or reverse not in ("0", "1"):
+            raise NotFound(self.invalid_cursor_message)
+        return pub_date, pk, reverse == "1"
+
+    def encode_cursor(self, cursor):
+        if cursor is None:
+            return None
+        pub_date, pk, reverse = cursor
+        encoded = urlsafe_b64encode(
+            f"{int(reverse)}|{pub_date.isoformat()}|{pk}".encode()).decode()
+        url = remove_query_param(
+            self.request.build_absolute_uri(), self.page_query_param)
+        return replace_query_param(url, self.cursor_query_param, encoded)
+
+    def get_paginated_response(self, data):
+        if not self.keyset:
+            return super().get_paginated_response(data)
+        return Response({
+            "next": self.encode_cursor(self.next_cursor),
+            "previous": self.encode_cursor(self.previous_cursor),
+            "results": data,
+        })
@@ -1,11 +1,43 @@
 from rest_framework import serializers
 from rest_framework.validators import UniqueTogetherValidator
 
+from recipes.cache import per_request
 from recipes.models import Recipe
 from users.models import Follow, User
 
 
-class UserSerializer(serializers.ModelSerializer):
+class SparseFieldsetMixin:
+    """Оставляет в ответе только поля из аргумента fields.
+
+    Список полей считает requested_fields по параметрам ?fields= и
+    ?omit=. Лишние поля удаляются до сериализации, поэтому их методы и
+    вложенные сериализаторы не вызываются, а view по тому же списку не
+    загружает для них данные.
+    """
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+    @classmethod
+    def requested_fields(cls, request):
+        """Поля Meta.fields с учётом ?fields= и ?omit=, без них None."""
+        only = request.query_params.get("fields")
+        omit = request.query_params.get("omit")
+        if not only and not omit:
+            return None
+        names = (
+            {name.strip() for name in only.split(",")} if only
+            else set(cls.Meta.fields)
+        )
+        if omit:
+            names -= {name.strip() for name in omit.split(",")}
+        return tuple(name for name in cls.Meta.fields if name in names)
+
+
+class UserSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     is_subscribed = serializers.SerializerMethodField()
 
     class Meta:
@@ -20,11 +52,13 @@ class UserSerializer(serializers.ModelSerializer):
         )
 
     def get_is_subscribed(self, obj):
+        if hasattr(obj, "is_subscribed"):
+            return obj.is_subscribed
         request = self.context.get("request")
-        return (
-            request.user.is_authenticated
-            and obj.following.filter(follower=request.user).exists()
-
+        return request.user.is_authenticated and obj.id in per_request(
+            request, "following_ids",
+            lambda: set(request.user.follower.values_list(
+                "following_id", flat=True)),
         )
 
 
@@ -51,16 +85,23 @@ class UserFollowSerializer(UserSerializer):
             "recipes_count",
         )
 
+    @staticmethod
+    def get_recipes_limit(request):
+        limit = request.GET.get("recipes_limit", "")
+        return int(limit) if limit.isdigit() else None
+
     def get_recipes_count(self, obj):
+        if hasattr(obj, "recipes_count"):
+            return obj.recipes_count
         return obj.recipes.count()
 
     def get_recipes(self, obj):
         request = self.context.get("request")
-        limit = request.GET.get("recipes_limit")
+        limit = self.get_recipes_limit(request)
         queryset = obj.recipes.all()
 
-        if limit.isdigit():
-            queryset = obj.recipes.all()[:int(limit)]
+        if limit is not None:
+            queryset = queryset[:limit]
 
         return FollowRecipeSerializer(
             queryset, many=True, context={"request": request}
@@ -1,3 +1,7 @@
+from django.db import transaction
+from django.db.models import (BooleanField, Count, Exists, F, OuterRef,
+                              Prefetch, Value, Window)
+from django.db.models.functions import RowNumber
 from django.shortcuts import get_object_or_404
 from djoser.views import UserViewSet as DJUserViewSet
 from rest_framework import status
@@ -5,6 +9,8 @@ from rest_framework.decorators import action
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 
+from recipes.feed import follow, unfollow
+from recipes.models import Recipe
 from users.models import Follow, User
 from users.pagination import UserRecipePagination
 from users.serializers import (FollowSerializer, UserFollowSerializer,
@@ -17,6 +23,29 @@ class UserViewSet(DJUserViewSet):
     pagination_class = UserRecipePagination
     permission_classes = [AllowAny]
 
+    def requested_fields(self):
+        """Поля ответа из ?fields= и ?omit= для GET, None - все поля."""
+        if self.request.method != "GET":
+            return None
+        return UserSerializer.requested_fields(self.request)
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        fields = self.requested_fields()
+        if self.request.user.is_authenticated and (
+            fields is None or "is_subscribed" in fields
+        ):
+            return queryset.annotate(is_subscribed=Exists(
+                Follow.objects.filter(
+                    follower=self.request.user, following=OuterRef("pk"))
+            ))
+        return queryset
+
+    def get_serializer(self, *args, **kwargs):
+        if self.get_serializer_class() is UserSerializer:
+            kwargs.setdefault("fields", self.requested_fields())
+        return super().get_serializer(*args, **kwargs)
+
     @action(
         detail=True, methods=["post"], permission_classes=[IsAuthenticated]
     )
@@ -28,7 +57,9 @@ class UserViewSet(DJUserViewSet):
             context={"request": request, 'following': following},
         )
         if serializer.is_valid():
-            serializer.save()
+            with transaction.atomic():
+                serializer.save()
+                follow(request.user.id, following.id)
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         else:
             return Response(
@@ -42,10 +73,30 @@ class UserViewSet(DJUserViewSet):
         permission_classes=[IsAuthenticated],
     )
     def subscriptions(self, request):
-        query = User.objects.filter(following__follower=request.user)
+        fields = UserFollowSerializer.requested_fields(request)
+        query = User.objects.filter(
+            following__follower=request.user
+        ).annotate(
+            is_subscribed=Value(True, output_field=BooleanField()),
+        ).order_by("username")
+        if fields is None or "recipes_count" in fields:
+            query = query.annotate(recipes_count=Count("recipes"))
+        if fields is None or "recipes" in fields:
+            recipes = Recipe.objects.only(
+                "id", "name", "image", "cooking_time", "author_id",
+                "pub_date")
+            limit = UserFollowSerializer.get_recipes_limit(request)
+            if limit is not None:
+                recipes = recipes.annotate(row_number=Window(
+                    RowNumber(), partition_by=F("author_id"),
+                    order_by=(F("pub_date").desc(), F("id").desc()),
+                )).filter(row_number__lte=limit)
+            query = query.prefetch_related(
+                Prefetch("recipes", queryset=recipes))
         paginated_content = self.paginate_queryset(queryset=query)
         serializer = UserFollowSerializer(
-            paginated_content, context={"request": request}, many=True
+            paginated_content, context={"request": request}, many=True,
+            fields=fields,
         )
         return self.get_paginated_response(serializer.data)
 
@@ -55,7 +106,9 @@ class UserViewSet(DJUserViewSet):
         following = get_object_or_404(User, pk=id)
         subscribe = Follow.objects.filter(follower=user, following=following)
         if subscribe.exists():
-            subscribe.delete()
+            with transaction.atomic():
+                subscribe.delete()
+                unfollow(user.id, following.id)
             return Response(status=status.HTTP_204_NO_CONTENT)
         return Response(status=status.HTTP_400_BAD_REQUEST)
 
@@ -69,7 +122,8 @@ class UserViewSet(DJUserViewSet):
             request.user,
             context={
                 'request': request
-            }
+            },
+            fields=UserSerializer.requested_fields(request),
         ).data
         return Response(
             data, status=200